@@ -0,0 +1,90 @@
+"""
+Payload sizes and codec costs of compressed chat bodies for large synthetic message histories,
+plus the round trip through the compression middleware echoing the history back.
+
+Run from the repository root: `python -m benchmarks.compression [megabits per second]`
+"""
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import asyncio, gzip, httpx, json, random, sys, time
+
+from src.core import compression
+
+
+HISTORY_LENGTHS = (10, 100, 1000)
+WORDS = "the model replied with a summary of the quarterly report including revenue costs and next steps for the team".split()
+
+
+def _history(length: int) -> list[dict]:
+    rng = random.Random(length)
+    roles = ("user", "assistant")
+    return [dict(role=roles[i % 2], content=" ".join(rng.choices(WORDS, k=rng.randint(20, 200)))) for i in range(length)]
+
+
+def _encode(body: bytes, encoding: str) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    if encoding == "zstd":
+        return compression.zstandard.ZstdCompressor(level=3).compress(body)
+    return body
+
+
+def _timed(func, repeat: int = 20) -> float:
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start_time) / repeat
+
+
+def _echo_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/")
+    async def _(request: Request):
+        return JSONResponse(await request.json())
+
+    app.add_middleware(compression.CompressionMiddleware)
+    return app
+
+
+async def _round_trip(client: httpx.AsyncClient, body: bytes, encoding: str, repeat: int = 20) -> float:
+    headers = {"content-type": "application/json", "accept-encoding": encoding}
+    content = _encode(body, encoding)
+    if encoding != "identity":
+        headers["content-encoding"] = encoding
+
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        response = await client.post("/", content=content, headers=headers)
+        response.raise_for_status()
+    return (time.perf_counter() - start_time) / repeat
+
+
+async def run(mbps: float):
+    encodings = ("identity", *reversed(compression.ENCODINGS))
+    bytes_per_second = mbps * 1e6 / 8
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=_echo_app()), base_url="http://benchmark") as client:
+        print(f"transfer estimated at {mbps:g} Mbit/s")
+
+        for length in HISTORY_LENGTHS:
+            body = json.dumps(dict(message_history=_history(length))).encode()
+            print(f"\n{length} messages ({len(body) / 1024:.0f} KiB json)")
+
+            for encoding in encodings:
+                encoded = _encode(body, encoding)
+                encode_ms = _timed(lambda: _encode(body, encoding)) * 1000
+                decode_ms = _timed(lambda: compression.decompress(encoded, encoding, len(body))) * 1000 if encoding != "identity" else 0
+                transfer_ms = len(encoded) / bytes_per_second * 1000
+                round_trip_ms = await _round_trip(client, body, encoding) * 1000
+
+                print(
+                    f"  {encoding:<9} {len(encoded) / 1024:>8.1f} KiB ({len(encoded) / len(body):>5.1%})"
+                    f"  encode {encode_ms:>6.2f} ms  decode {decode_ms:>5.2f} ms"
+                    f"  transfer {transfer_ms:>7.1f} ms  echo round trip {round_trip_ms:>6.2f} ms"
+                )
+
+
+if __name__ == "__main__":
+    asyncio.run(run(float(sys.argv[1]) if len(sys.argv) > 1 else 100))
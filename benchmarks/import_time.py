@@ -0,0 +1,62 @@
+"""
+Import time of the app and its slowest modules to catch cold start regressions.
+
+Runs `python -X importtime -c "import main"` in fresh interpreters and exits non-zero if the
+median exceeds the budget, e.g. in CI.
+
+Run from the repository root: `python -m benchmarks.import_time [budget seconds] [runs]`
+"""
+
+import statistics, subprocess, sys
+
+
+TOP = 15
+
+
+def _import_times(module: str) -> tuple[float, list[tuple[int, str]]]:
+    "Total seconds and (cumulative µs, module) per imported module of one fresh interpreter."
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.removeprefix("import time:").split("|")
+        modules.append((int(cumulative), name.rstrip()))
+
+    total = next(cumulative for cumulative, name in reversed(modules) if name.strip() == module)
+    return total / 1e6, modules
+
+
+def run(budget: float, runs: int):
+    totals, modules = [], []
+    for _ in range(runs):
+        total, modules = _import_times("main")
+        totals.append(total)
+
+    median = statistics.median(totals)
+    print(f"import main: {median:.3f} s median of {runs} runs (budget {budget:.2f} s)")
+
+    print(f"\nslowest imports of main (last run):")
+    # names are indented by two spaces per nesting level below the imported module
+    direct = [(cumulative, name) for cumulative, name in modules if len(name) - len(name.lstrip()) == 3]
+    for cumulative, name in sorted(direct, reverse=True)[:TOP]:
+        print(f"  {cumulative / 1000:>8.1f} ms  {name.strip()}")
+
+    for heavy in ("litellm", "langfuse"):
+        if any(name.strip() == heavy for _, name in modules):
+            print(f"\nwarning: {heavy} is imported at startup")
+
+    if median > budget:
+        print(f"\nimport time exceeds the budget by {median - budget:.3f} s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run(
+        float(sys.argv[1]) if len(sys.argv) > 1 else 1.0,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5,
+    )
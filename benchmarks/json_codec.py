@@ -0,0 +1,57 @@
+"""
+Encoding SSE events and decoding request bodies with the stdlib path used before compared to the
+configured json codec, for message histories of 10, 100 and 1000 messages.
+
+Run from the repository root: `python -m benchmarks.json_codec [repeat]`
+"""
+
+from sse_starlette.sse import ServerSentEvent
+import json, random, sys, time
+
+from src.core import codec, sse
+
+
+HISTORY_LENGTHS = (10, 100, 1000)
+WORDS = "the model replied with a summary of the quarterly report including revenue costs and next steps for the team".split()
+
+
+def _payload(length: int) -> dict:
+    rng = random.Random(length)
+    roles = ("user", "assistant")
+    messages = [dict(role=roles[i % 2], content=" ".join(rng.choices(WORDS, k=rng.randint(20, 200)))) for i in range(length)]
+    return dict(messages=messages, tool_calls=None, schema=None, history_version=None, history_offset=None, cached=False)
+
+
+def _timed(func, repeat: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start_time) / repeat
+
+
+def _stdlib_event(payload: dict) -> bytes:
+    "The previous path: json.dumps to str, then sse_starlette re-encoding the event to bytes."
+
+    return ServerSentEvent(json.dumps(payload), event="success").encode()
+
+
+def run(repeat: int):
+    print(f"codec: {codec.name}")
+
+    for length in HISTORY_LENGTHS:
+        payload = _payload(length)
+        body = json.dumps(dict(message_history=payload["messages"])).encode()
+        scale = max(1, 1000 // length)
+
+        stdlib_encode = _timed(lambda: _stdlib_event(payload), repeat * scale)
+        codec_encode = _timed(lambda: sse._serialize("success", payload), repeat * scale)
+        stdlib_decode = _timed(lambda: json.loads(body), repeat * scale)
+        codec_decode = _timed(lambda: codec.loads(body), repeat * scale)
+
+        print(f"\n{length} messages ({len(body) / 1024:.0f} KiB)")
+        print(f"  sse event:    stdlib {stdlib_encode * 1e6:>8.1f} µs  codec {codec_encode * 1e6:>8.1f} µs  ({stdlib_encode / codec_encode:.1f}x)")
+        print(f"  request body: stdlib {stdlib_decode * 1e6:>8.1f} µs  codec {codec_decode * 1e6:>8.1f} µs  ({stdlib_decode / codec_decode:.1f}x)")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,320 @@
+"""
+Throughput, tail latency, CPU and memory of `main:app` under load without spending tokens.
+
+The app runs in a child process with a deterministic fake provider behind `litellm.async_call` and
+a local stand-in for `langfuse.fetch_prompt`, and is driven through `/ai/chat` by `client.py` at
+the given concurrency. Scenarios cover text turns, structured output, long histories and tool
+loops. Fake latencies and replies are seeded per request, so runs are comparable across commits;
+`--json` writes the results for diffing.
+
+Run from the repository root: `python -m benchmarks.load [--scenarios text tools] [--concurrency 32] [--chats 200]`
+"""
+
+from pydantic import BaseModel, Field
+import argparse, asyncio, json, math, multiprocessing, os, random, socket, statistics, subprocess, sys, tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)  # the client lives in the repository root
+
+import client
+
+
+API_KEY = "benchmark-key"
+PROJECT = "benchmark"
+WORDS = "the model replied with a summary of the quarterly report including revenue costs and next steps for the team".split()
+SCHEMA = """
+class Answer(BaseModel):
+    summary: str
+    score: int
+"""
+TOOLS = [
+    dict(
+        type="function",
+        function=dict(
+            name="lookup",
+            description="Looks up a record",
+            parameters=dict(type="object", properties=dict(key=dict(type="string")), required=["key"]),
+        ),
+    )
+]
+
+
+class Settings(BaseModel):
+    latency_ms: float = Field(200, description="median fake provider latency")
+    latency_sigma: float = Field(0.5, description="spread of the lognormal latency, 0 for a fixed latency")
+    output_tokens: int = Field(150, description="words per reply, counted as tokens")
+    prompt_ms: float = Field(0, description="latency of prompt fetches missing the prompt cache")
+    tool_rounds: int = Field(3, description="tool calls before the final reply in the tools scenario")
+    history_length: int = Field(200, description="messages sent in the long history scenario")
+    seed: int = Field(0, description="seed of fake latencies and replies")
+
+
+# HELPER (fake backends, run in the server process)
+
+
+class _FakeFunction(BaseModel):
+    name: str
+    arguments: str
+
+
+class _FakeToolCall(BaseModel):
+    id: str
+    type: str = "function"
+    function: _FakeFunction
+
+
+class _FakeMessage(BaseModel):
+    role: str = "assistant"
+    content: str | None = None
+    tool_calls: list[_FakeToolCall] | None = None
+
+
+class _FakePrompt:
+    def __init__(self, name: str, config: dict):
+        self.name = name
+        self.version = 1
+        self.config = config
+
+    def compile(self, **placeholders) -> list[dict]:
+        topic = placeholders.get("topic", "the report")
+        return [dict(role="system", content="You are a helpful assistant."), dict(role="user", content=f"Write about {topic}.")]
+
+
+PROMPT_CONFIGS = dict(
+    text=dict(model="fake/model", temperature=0.7),
+    structured=dict(model="fake/model", temperature=0.7, pydantic_schema=SCHEMA),
+    tools=dict(model="fake/model", temperature=0.7, tools=TOOLS, tool_choice="auto"),
+)
+
+
+def _install_fakes(settings: Settings):
+    from src.services import langfuse, litellm
+
+    async def fetch(prompt_config):
+        await asyncio.sleep(settings.prompt_ms / 1000)
+        return _FakePrompt(prompt_config.args.name, dict(PROMPT_CONFIGS[prompt_config.args.name]))
+
+    async def fetch_prompt(prompt_config):
+        return await langfuse.prompt_cache.get(langfuse.PromptCache.key(prompt_config), lambda: fetch(prompt_config))
+
+    async def async_call(**params):
+        messages = params["messages"]
+        last = messages[-1]
+        rng = random.Random(f"{settings.seed}:{len(messages)}:{last.get('content')}")
+
+        latency = settings.latency_ms * (math.exp(rng.gauss(0, settings.latency_sigma)) if settings.latency_sigma else 1)
+        await asyncio.sleep(latency / 1000)
+
+        prompt_tokens = sum(len(str(message.get("content") or "").split()) for message in messages)
+        tokens = prompt_tokens + settings.output_tokens
+
+        # keep calling the tool until enough rounds (a call and its result) followed the last user message
+        since_user = next((i for i, message in enumerate(reversed(messages)) if message.get("role") == "user"), 0)
+        if params.get("tools") and since_user < settings.tool_rounds * 2:
+            arguments = json.dumps(dict(key=str(since_user // 2)))
+            tool_call = _FakeToolCall(id=f"call_{rng.getrandbits(32)}", function=_FakeFunction(name="lookup", arguments=arguments))
+            message = _FakeMessage(tool_calls=[tool_call])
+            return None, [tool_call], message, tokens
+
+        reply = " ".join(rng.choices(WORDS, k=settings.output_tokens))
+        if params.get("response_format"):
+            reply = json.dumps(dict(summary=reply, score=rng.randint(0, 100)))
+        return reply, None, _FakeMessage(content=reply), tokens
+
+    langfuse.fetch_prompt = fetch_prompt
+    litellm.async_call = async_call
+
+
+def _rss() -> int | None:
+    "Current resident memory in bytes (Linux only)."
+
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _serve(port: int, settings: dict):
+    "Child process: the app with fake backends and an endpoint reporting its resource usage."
+
+    import resource
+
+    # an empty working directory so a local .env does not override the benchmark settings
+    os.chdir(tempfile.mkdtemp())
+    os.environ.update(
+        ACCESS_KEYS=json.dumps([API_KEY]),
+        RATE_LIMITS_DEFAULT=json.dumps(["1000000/second"]),
+        STARTUP_MODE="lazy",
+        TRACE_EXPORT="off",
+    )
+    # request logs are written but discarded
+    sys.stdout = sys.stderr = open(os.devnull, "w")
+
+    import uvicorn
+    from main import app
+
+    _install_fakes(Settings(**settings))
+
+    @app.get("/benchmark/usage")
+    def usage():
+        rusage = resource.getrusage(resource.RUSAGE_SELF)
+        max_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        return dict(cpu=rusage.ru_utime + rusage.ru_stime, rss=_rss() or max_rss, max_rss=max_rss)
+
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+# HELPER (load, run in the benchmark process)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _history(length: int) -> list[dict]:
+    rng = random.Random(length)
+    roles = ("user", "assistant")
+    return [dict(role=roles[i % 2], content=" ".join(rng.choices(WORDS, k=rng.randint(20, 200)))) for i in range(length)]
+
+
+def _lookup(key: str) -> dict:
+    return dict(key=key, value=f"record {key}")
+
+
+def _prompt(name: str, topic: int) -> dict:
+    return dict(args=dict(name=name), placeholders=dict(topic=f"topic {topic}"))
+
+
+async def _chat(overlord: client.Overlord, scenario: str, index: int, settings: Settings, latencies: list[float]):
+    "One chat of the scenario, recording the latency of each turn."
+
+    if scenario == "long_history":
+        chat = overlord.chat(_history(settings.history_length))
+        turns = [overlord.input(prompt=_prompt("text", index)), overlord.input(prompt="Continue.")]
+    elif scenario == "tools":
+        chat = overlord.chat()
+        turns = [overlord.input(prompt=_prompt("tools", index), tools=dict(lookup=_lookup))]
+    elif scenario == "structured":
+        chat = overlord.chat()
+        turns = [overlord.input(prompt=_prompt("structured", index)), overlord.input(prompt="Again.")]
+    else:
+        chat = overlord.chat()
+        turns = [overlord.input(prompt=_prompt("text", index)), overlord.input(prompt="Shorter."), overlord.input(prompt="Thanks.")]
+
+    for data in turns:
+        start_time = time.perf_counter()
+        await chat.request(data)
+        latencies.append(time.perf_counter() - start_time)
+
+
+async def _usage(overlord: client.Overlord) -> dict:
+    return (await overlord.client._client.get(overlord.client._construct_url("benchmark/usage"))).json()
+
+
+def _percentile(values: list[float], percent: float) -> float:
+    return sorted(values)[min(len(values) - 1, math.ceil(percent / 100 * len(values)) - 1)]
+
+
+async def _scenario(overlord: client.Overlord, scenario: str, chats: int, concurrency: int, settings: Settings) -> dict:
+    # warm up caches and connections before measuring
+    await asyncio.gather(*(_chat(overlord, scenario, index, settings, []) for index in range(min(concurrency, chats))))
+
+    latencies, errors = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index: int):
+        nonlocal errors
+        async with semaphore:
+            try:
+                await _chat(overlord, scenario, index, settings, latencies)
+            except Exception:
+                errors += 1
+
+    before = await _usage(overlord)
+    start_time = time.perf_counter()
+    await asyncio.gather(*(run(index) for index in range(chats)))
+    seconds = time.perf_counter() - start_time
+    after = await _usage(overlord)
+
+    return dict(
+        scenario=scenario,
+        turns=len(latencies),
+        errors=errors,
+        rps=len(latencies) / seconds,
+        p50_ms=statistics.median(latencies) * 1000 if latencies else None,
+        p95_ms=_percentile(latencies, 95) * 1000 if latencies else None,
+        p99_ms=_percentile(latencies, 99) * 1000 if latencies else None,
+        cpu_percent=(after["cpu"] - before["cpu"]) / seconds * 100,
+        rss_mb=after["rss"] / 2**20,
+        max_rss_mb=after["max_rss"] / 2**20,
+    )
+
+
+def _commit() -> str:
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    return result.stdout.strip() or "unknown"
+
+
+async def _wait_until_ready(overlord: client.Overlord, server: multiprocessing.Process, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not server.is_alive():
+            raise RuntimeError("Benchmark server exited on startup")
+        try:
+            await overlord.client.ping()
+            return
+        except Exception:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Benchmark server did not start in time")
+
+
+async def run(scenarios: list[str], chats: int, concurrency: int, settings: Settings, output: str | None):
+    port = _free_port()
+    server = multiprocessing.get_context("spawn").Process(target=_serve, args=(port, settings.model_dump()), daemon=True)
+    server.start()
+
+    overlord = client.Overlord(f"http://127.0.0.1:{port}", API_KEY, PROJECT, concurrency=concurrency, timeout=300, retry_policy=client.RetryPolicy(retries=0))
+
+    try:
+        await _wait_until_ready(overlord, server)
+
+        print(f"commit {_commit()}, {chats} chats per scenario at concurrency {concurrency}")
+        print(f"settings {settings.model_dump()}\n")
+        print(f"{'scenario':<13} {'turns':>6} {'errors':>6} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'cpu %':>6} {'rss MB':>7}")
+
+        results = []
+        for scenario in scenarios:
+            result = await _scenario(overlord, scenario, chats, concurrency, settings)
+            results.append(result)
+            print(
+                f"{scenario:<13} {result['turns']:>6} {result['errors']:>6} {result['rps']:>8.1f} {result['p50_ms'] or 0:>8.1f}"
+                f" {result['p95_ms'] or 0:>8.1f} {result['p99_ms'] or 0:>8.1f} {result['cpu_percent']:>6.1f} {result['rss_mb']:>7.1f}"
+            )
+
+    finally:
+        server.terminate()
+        server.join()
+
+    if output:
+        with open(output, "w") as file:
+            json.dump(dict(commit=_commit(), chats=chats, concurrency=concurrency, settings=settings.model_dump(), results=results), file, indent=2)
+
+
+SCENARIOS = ("text", "structured", "long_history", "tools")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--chats", type=int, default=200, help="chats per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--json", dest="output", help="write the results to this file")
+    for name, field in Settings.model_fields.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(field.default), default=field.default, help=field.description)
+    args = parser.parse_args()
+
+    settings = Settings(**{name: getattr(args, name) for name in Settings.model_fields})
+    asyncio.run(run(args.scenarios, args.chats, args.concurrency, settings, args.output))
@@ -0,0 +1,108 @@
+"""
+Per-request overhead of the request middleware compared to the previous
+BaseHTTPMiddleware logging plus decorator rate limit stack.
+
+Run from the repository root: `python -m benchmarks.middleware [requests]`
+"""
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+from logging.handlers import QueueHandler, QueueListener
+import asyncio, httpx, logging, os, queue, sys, time
+
+from src.core import logging as core_logging, middleware
+from src.security.limits import RateLimiter
+
+
+RATES = {"default": ["1000000/second"]}
+
+
+def _base_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/")
+    def _():
+        return Response("ok")
+
+    return app
+
+
+def _devnull_handler() -> logging.Handler:
+    handler = logging.StreamHandler(open(os.devnull, "w"))
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    return handler
+
+
+def legacy_app() -> FastAPI:
+    "The stack before: a BaseHTTPMiddleware for logging writing synchronously and a decorator middleware for limits."
+
+    app = _base_app()
+    logger = logging.getLogger("benchmark.legacy")
+    logger.setLevel(logging.INFO)
+    handler = _devnull_handler()
+    handler.setFormatter(core_logging.JsonFormatter())
+    logger.addHandler(handler)
+    limiter = RateLimiter(RATES)
+
+    @app.middleware("http")
+    async def rate_limit_middleware(request: Request, call_next):
+        status = limiter.check_request(request.client.host, request.headers.get("x-client-type", "default"))
+        if status.exceeded:
+            return JSONResponse(status_code=429, content={})
+        return await call_next(request)
+
+    class LoggingMiddleware(BaseHTTPMiddleware):
+        async def dispatch(self, request, call_next):
+            start_time = time.time()
+            logger.info("Request", extra=dict(method=request.method, endpoint=request.url.path))
+            response = await call_next(request)
+            ms = round((time.time() - start_time) * 1000)
+            logger.info("Response", extra=dict(method=request.method, endpoint=request.url.path, status=response.status_code, ms=ms))
+            return response
+
+    app.add_middleware(LoggingMiddleware)
+    return app
+
+
+def current_app() -> tuple[FastAPI, QueueListener]:
+    app = _base_app()
+    core_logging.logger = logger = logging.getLogger("benchmark.current")
+    logger.setLevel(logging.INFO)
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(core_logging.JsonFormatter())
+    logger.addHandler(queue_handler)
+    listener = QueueListener(log_queue, _devnull_handler())
+    listener.start()
+
+    middleware.setup(app, RateLimiter(RATES))
+    return app, listener
+
+
+async def _measure(app: FastAPI, requests: int) -> float:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+        for _ in range(100):
+            await client.get("/")
+
+        start_time = time.perf_counter()
+        for _ in range(requests):
+            await client.get("/")
+        return (time.perf_counter() - start_time) / requests
+
+
+async def run(requests: int):
+    bare = await _measure(_base_app(), requests)
+    legacy = await _measure(legacy_app(), requests)
+    app, listener = current_app()
+    current = await _measure(app, requests)
+    listener.stop()
+
+    print(f"requests:             {requests}")
+    print(f"no middleware:        {bare * 1e6:.0f} µs/request")
+    print(f"legacy middlewares:   {legacy * 1e6:.0f} µs/request (+{(legacy - bare) * 1e6:.0f} µs)")
+    print(f"request middleware:   {current * 1e6:.0f} µs/request (+{(current - bare) * 1e6:.0f} µs)")
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
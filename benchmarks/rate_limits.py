@@ -0,0 +1,48 @@
+"""
+Per-check cost and memory of the rate limiter at many distinct clients.
+
+Run from the repository root: `python -m benchmarks.rate_limits [clients]`
+"""
+
+from src.security.limits import RateLimiter
+import sys, time, tracemalloc
+
+
+RATES = {"default": ["1/second", "10/minute", "100/hour", "1000/day"]}
+
+
+def _ips(clients: int) -> list[str]:
+    return [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(clients)]
+
+
+def _timed_pass(limiter: RateLimiter, ips: list[str]) -> float:
+    start_time = time.perf_counter()
+    for ip in ips:
+        limiter.check_request(ip, "default")
+    return (time.perf_counter() - start_time) / len(ips)
+
+
+def run(clients: int):
+    ips = _ips(clients)
+
+    limiter = RateLimiter(RATES)
+    new_key = _timed_pass(limiter, ips)
+    known_key = _timed_pass(limiter, ips)
+
+    # measured separately as tracing slows down every allocation
+    tracemalloc.start()
+    limiter = RateLimiter(RATES)
+    baseline, _ = tracemalloc.get_traced_memory()
+    _timed_pass(limiter, ips)
+    used = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    print(f"clients:           {clients}")
+    print(f"tracked keys:      {len(limiter.history)}")
+    print(f"check (new key):   {new_key * 1e6:.2f} µs")
+    print(f"check (known key): {known_key * 1e6:.2f} µs")
+    print(f"memory:            {used / 2**20:.1f} MiB ({used / clients:.0f} B/client)")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
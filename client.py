@@ -1,12 +1,40 @@
-from typing import Literal, Callable, AsyncGenerator
+from typing import Literal, Callable, AsyncGenerator, AsyncIterable, Iterable
 from pydantic import BaseModel
-import httpx, json, contextlib, uuid, asyncio, inspect
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from email.utils import parsedate_to_datetime
+import httpx, json, contextlib, uuid, asyncio, functools, inspect, random, time, gzip
+
+try:
+    import zstandard
+except ImportError:  # only gzip request bodies without zstandard, responses are decoded by httpx
+    zstandard = None
+
+try:
+    import orjson
+except ImportError:  # stdlib json is used without orjson
+    orjson = None
+
+try:
+    import websockets
+except ImportError:  # persistent chats require websockets
+    websockets = None
+
+
+def json_loads(data: str | bytes):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def json_dumps_bytes(data) -> bytes:
+    if orjson:
+        with contextlib.suppress(TypeError):
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
 
 
 def loads_if_json(data):
     if isinstance(data, str):
         with contextlib.suppress(json.JSONDecodeError):
-            data = json.loads(data)
+            data = json_loads(data)
     return data
 
 
@@ -26,6 +54,121 @@ class OverlordClientError(Exception):
     "Raised if anything in the overlord client fails."
 
 
+class RetryPolicy(BaseModel):
+    """
+    When and how long the client waits before retrying a failed request.
+
+    Only requests that failed before any event was received are retried, so a retry never
+    duplicates a streamed reply and the chat state is only updated by the successful attempt.
+    """
+
+    retries: int = 3  # 0 disables retrying
+    backoff: float = 0.5  # seconds, doubled per retry with full jitter
+    max_backoff: float = 30
+    deadline: float | None = 120  # seconds across all attempts including waits
+    statuses: tuple[int, ...] = (429, 502, 503, 504)
+    # transient server error event types (provider rate limits, outages and overload)
+    errors: tuple[str, ...] = (
+        "RateLimitError",
+        "APIConnectionError",
+        "Timeout",
+        "ServiceUnavailableError",
+        "InternalServerError",
+        "BadGatewayError",
+        "ServiceOverloaded",
+    )
+    transport_errors: tuple[type[Exception], ...] = (
+        httpx.ConnectError,
+        httpx.ConnectTimeout,
+        httpx.PoolTimeout,
+        httpx.ReadError,
+        httpx.RemoteProtocolError,
+    )
+
+
+class ToolExecutor:
+    """
+    Runs the tool calls of all chats sharing an Overlord.
+
+    Async tools run on the event loop and sync tools on a thread pool, or on a process pool if
+    named in `process_tools` (for CPU heavy tools, which must then be picklable module level
+    functions). At most `max_concurrency` tools run at once and each call is cancelled after its
+    timeout (`timeouts` per tool name, else `timeout`), though a sync tool's thread or process
+    runs to its end in the background. Failures are returned to the model as tool error messages.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 10,
+        timeout: float | None = 60,  # seconds, None for no timeout
+        timeouts: dict[str, float | None] | None = None,
+        process_tools: Iterable[str] = (),
+        max_workers: int | None = None,  # threads, defaults to max_concurrency
+        max_processes: int | None = None,  # defaults to the number of cpus
+    ):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.process_tools = set(process_tools)
+        self.max_workers = max_workers or max_concurrency
+        self.max_processes = max_processes
+        # ---
+        self._semaphore = None
+        self._threads = None
+        self._processes = None
+
+    def _executor(self, name: str) -> Executor:
+        if name in self.process_tools:
+            if self._processes is None:
+                self._processes = ProcessPoolExecutor(max_workers=self.max_processes)
+            return self._processes
+
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="overlord-tool")
+        return self._threads
+
+    async def _run(self, name: str, function: Callable, arguments: dict):
+        if inspect.iscoroutinefunction(function):
+            return await function(**arguments)
+        return await asyncio.get_running_loop().run_in_executor(self._executor(name), functools.partial(function, **arguments))
+
+    async def call(self, tool_call: dict, tools: dict[str, Callable]) -> dict:
+        "Run a tool call and return the tool message answering it, with the error as content if it failed."
+
+        name = tool_call["function"]["name"]
+        timeout = self.timeouts.get(name, self.timeout)
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        try:
+            if name not in tools:
+                raise OverlordClientError(f"Tool '{name}' not in available tools '{', '.join(tools)}'")
+
+            arguments = json.loads(tool_call["function"]["arguments"] or "{}")
+
+            async with self._semaphore:
+                try:
+                    response = await asyncio.wait_for(self._run(name, tools[name], arguments), timeout)
+                except asyncio.TimeoutError:
+                    raise TimeoutError(f"Tool '{name}' timed out after {timeout} seconds") from None
+
+            content = response if isinstance(response, str) else json.dumps(response)
+
+        except Exception as e:
+            content = f"Error: {type(e).__name__}: {e}"
+
+        return dict(tool_call_id=tool_call["id"], role="tool", name=name, content=content)
+
+    def shutdown(self, wait: bool = True):
+        "Stop the thread and process pools, they are created again on the next sync tool call."
+
+        for executor in (self._threads, self._processes):
+            if executor is not None:
+                executor.shutdown(wait=wait)
+        self._threads = self._processes = None
+
+
 # ---
 
 
@@ -47,14 +190,33 @@ class _Client:
     ```
     """
 
-    def __init__(self, server: str, api_key: str, client_type: str, timeout: int = 60):
+    def __init__(
+        self,
+        server: str,
+        api_key: str,
+        client_type: str,
+        timeout: int = 60,
+        max_connections: int = 10,
+        retry_policy: RetryPolicy | None = None,
+        compression: Literal["gzip", "zstd"] | None = "gzip",
+        compression_min_size: int = 1024,
+    ):
         if not server:
             raise OverlordClientError("No server url specified!")
         if not api_key:
             raise OverlordClientError("No api key specified!")
 
         self._server = server
-        self._client = httpx.AsyncClient(timeout=httpx.Timeout(timeout or 60))
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout or 60),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.compression = compression
+        self.compression_min_size = compression_min_size
+
+        if compression == "zstd" and not zstandard:
+            raise OverlordClientError("zstd compression requires the zstandard package!")
 
         self._auth(api_key)
         self._set_client_type_header(client_type or "default")
@@ -63,6 +225,24 @@ class _Client:
     def _construct_url(self, endpoint: str = None):
         return f"{self._server.rstrip('/')}/{(endpoint or '').lstrip('/')}"
 
+    def _encode_body(self, data: dict | None) -> tuple[bytes | None, dict]:
+        "Serialize the json body once for all attempts, compressed if it is large enough to be worth it."
+
+        if data is None:
+            return None, {}
+
+        body = json_dumps_bytes(data)
+        headers = {"content-type": "application/json"}
+
+        if self.compression and len(body) >= self.compression_min_size:
+            if self.compression == "zstd":
+                body = zstandard.ZstdCompressor().compress(body)
+            else:
+                body = gzip.compress(body, compresslevel=6)
+            headers["content-encoding"] = self.compression
+
+        return body, headers
+
     def _create_server_error(self, event_data):
         error_type = event_data["type"]
         ErrorClass = type(error_type, (Exception,), {})
@@ -78,15 +258,44 @@ class _Client:
             if line.startswith("data:"):
                 event_data = line.split(":", 1)[1].strip()
                 try:
-                    yield event_type, json.loads(event_data)
+                    yield event_type, json_loads(event_data)
                 except json.JSONDecodeError:
                     continue
 
-    async def _raise_or_return(self, response):
-        async for event_type, event_data in self._parse_sse(response):
-            if event_type == "error":
-                raise self._create_server_error(event_data)
-            yield event_data
+    @staticmethod
+    def _parse_retry_after(response: httpx.Response) -> float | None:
+        retry_after = response.headers.get("retry-after")
+        if not retry_after:
+            return None
+
+        with contextlib.suppress(ValueError):
+            return max(0.0, float(retry_after))
+        with contextlib.suppress(TypeError, ValueError):
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        return None
+
+    def _retry_delay(self, error: Exception, attempt: int, start_time: float) -> float | None:
+        "Seconds to wait before retrying or None if the error is fatal or retrying would exceed the deadline."
+
+        policy = self.retry_policy
+        if attempt >= policy.retries:
+            return None
+
+        retry_after = None
+        if isinstance(error, httpx.HTTPStatusError):
+            if error.response.status_code not in policy.statuses:
+                return None
+            retry_after = self._parse_retry_after(error.response)
+        elif not isinstance(error, policy.transport_errors) and type(error).__name__ not in policy.errors:
+            return None
+
+        delay = random.uniform(0, min(policy.max_backoff, policy.backoff * 2**attempt))
+        if retry_after is not None:
+            delay += retry_after  # jitter on top so clients told the same time do not all return at once
+
+        if policy.deadline is not None and time.monotonic() - start_time + delay > policy.deadline:
+            return None
+        return delay
 
     def _auth(self, api_key: str):
         if "x-api-key" not in self._client.headers or self._client.headers["x-api-key"] != api_key:
@@ -97,11 +306,64 @@ class _Client:
             self._client.headers.update({"x-client-type": client_type})
 
     # public interfaces
+    def connect(self, endpoint: str):
+        "Open a websocket to the endpoint with the same api key and compression as requests."
+
+        if not websockets:
+            raise OverlordClientError("Persistent chats require the websockets package!")
+
+        url = self._construct_url(endpoint)
+        return websockets.connect(
+            "ws" + url.removeprefix("http") if url.startswith("http") else url,
+            additional_headers={name: self._client.headers[name] for name in ("x-api-key", "x-client-type") if name in self._client.headers},
+            compression="deflate" if self.compression else None,
+            open_timeout=self._client.timeout.connect,
+            max_size=None,  # the first response carries the full history
+        )
+
     async def ping(self) -> httpx.Response:
         response = await self._client.request("GET", self._construct_url())
         response.raise_for_status()
         return response
 
+    async def events(
+        self,
+        endpoint: str = None,
+        method: Literal["GET", "POST"] = "GET",
+        data: dict = None,
+    ) -> AsyncGenerator:
+        "Yields (event_type, event_data) as they arrive and raises on error events after retrying per the retry policy."
+
+        start_time = time.monotonic()
+        attempt = 0
+        body, headers = self._encode_body(data)
+
+        while True:
+            received = False
+            try:
+                async with self._client.stream(
+                    method,
+                    self._construct_url(endpoint),
+                    content=body,
+                    headers=headers,
+                ) as response:
+                    response.raise_for_status()
+                    async for event_type, event_data in self._parse_sse(response):
+                        if event_type == "error":
+                            raise self._create_server_error(event_data)
+                        received = True
+                        yield event_type, event_data
+                return
+
+            except Exception as e:
+                # never retry once events were passed on as that would duplicate them
+                delay = None if received else self._retry_delay(e, attempt, start_time)
+                if delay is None:
+                    raise
+
+            attempt += 1
+            await asyncio.sleep(delay)
+
     async def request(
         self,
         endpoint: str = None,
@@ -109,14 +371,106 @@ class _Client:
         data: dict = None,
     ) -> AsyncGenerator:
 
-        async with self._client.stream(
-            method,
-            self._construct_url(endpoint),
-            json=data,
-        ) as response:
-            response.raise_for_status()
-            async for event_data in self._raise_or_return(response):
-                yield event_data
+        async for _, event_data in self.events(endpoint, method, data):
+            yield event_data
+
+
+class _Connection:
+    """
+    Persistent websocket connection sending chat turns as frames and yielding their events.
+
+    Connects on first use and again if the connection was lost before a turn received any event.
+    `make_frame(fresh)` is called per attempt with `fresh` set until a turn succeeded on the current
+    connection, as the server only holds the session state of turns it answered on that connection.
+    A turn given up before its success or error event (cancelled, timed out or not read to the end)
+    drops the connection, so the next turn starts on a fresh one instead of reading the late reply.
+    """
+
+    def __init__(self, client: _Client, endpoint: str):
+        self._client = client
+        self._endpoint = endpoint
+        self._websocket = None
+        self._fresh = True
+        self._busy = None  # connection with a turn sent but not answered, until its events were read
+        self._closing = set()  # close handshakes of dropped connections
+
+    async def _connect(self):
+        if self._websocket is None:
+            self._websocket = await self._client.connect(self._endpoint)
+            self._fresh = True
+        return self._websocket
+
+    async def close(self):
+        if self._websocket is not None:
+            await self._websocket.close()
+            self._websocket = None
+
+    def _drop(self, websocket):
+        "Forget a connection whose turn was abandoned, as the server still answers it and the next turn would read that reply."
+
+        if self._websocket is websocket:
+            self._websocket = None
+        if self._busy is websocket:
+            self._busy = None
+        task = asyncio.ensure_future(websocket.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def events(self, make_frame: Callable[[bool], dict]) -> AsyncGenerator:
+        start_time = time.monotonic()
+        attempt = 0
+        reconnected = False
+
+        while True:
+            received = finished = False
+            websocket = None
+            # a stream left with break is only closed once it is garbage collected, possibly after this
+            if self._busy is not None:
+                self._drop(self._busy)
+
+            try:
+                websocket = await self._connect()
+                await websocket.send(json_dumps_bytes(make_frame(self._fresh)).decode())
+                self._busy = websocket
+
+                async for message in websocket:
+                    event = json_loads(message)
+                    if finished := event["event"] in ("success", "error"):
+                        self._busy = None
+                    if event["event"] == "error":
+                        raise self._client._create_server_error(event["data"])
+
+                    received = True
+                    if event["event"] == "success":
+                        self._fresh = False
+                    yield event["event"], event["data"]
+
+                    if event["event"] == "success":
+                        return
+
+                # the iterator ends quietly when the server closed the connection
+                raise websockets.ConnectionClosedOK(None, None)
+
+            except (websockets.ConnectionClosed, OSError):
+                self._websocket = None
+                # reconnect right away once as idle connections are dropped by proxies and servers
+                if received or reconnected:
+                    raise
+                reconnected = True
+                continue
+
+            except Exception as e:
+                delay = None if received else self._client._retry_delay(e, attempt, start_time)
+                if delay is None:
+                    raise
+
+            finally:
+                # cancelled, timed out or not read to the end before the server answered the turn
+                if websocket is not None and not finished:
+                    self._drop(websocket)
+
+            attempt += 1
+            await asyncio.sleep(delay)
 
 
 # ---
@@ -127,6 +481,7 @@ class ChatInput(BaseModel):
     file_urls: list[str] = None
     metadata: dict = None
     tools: dict[str, Callable] = None
+    cache: bool | None = None
 
 
 class ChatRequest(BaseModel):
@@ -149,6 +504,11 @@ class ChatRequest(BaseModel):
     message_history:
         - built server-side
         - returned to client
+        - only the messages added since history_version if that is set
+
+    history_version:
+        - returned by servers keeping session histories
+        - lets the client send and receive only new messages
 
     file_urls:
         - outside of langfuse prompt so files can be provided to text_prompt calls
@@ -156,6 +516,13 @@ class ChatRequest(BaseModel):
     metadata:
         - will always contain at least the session_id
         - can contain custom metadata
+
+    stream:
+        - server sends delta events while generating before the final success event
+
+    cache:
+        - reuse responses of identical deterministic (temperature 0) calls
+        - overrides the "cache" flag of the langfuse prompt config if set
     """
 
     lf_prompt_config: PromptConfig
@@ -167,19 +534,26 @@ class ChatRequest(BaseModel):
     file_urls: list[str] | None = None
     output_schema: str | None = None
     metadata: dict
+    stream: bool = False
+    history_version: str | None = None
+    cache: bool | None = None
 
 
 class _Chat:
-    def __init__(self, overlord, existing_message_history: list | None = None):
+    def __init__(self, overlord, existing_message_history: list | None = None, persistent: bool = False):
         self.session_id = f"overlord_{uuid.uuid4()}"
         self._overlord = overlord
         self._endpoint = "ai/chat"
+        self._connection = _Connection(overlord.client, "ai/ws") if persistent else None
         self.tools = None
         # ---
         self._message_history = existing_message_history
         self._initial_lf_prompt_config = None
         self._initial_response_schema = None
         self._active_lf_prompt_config = None
+        self._history_version = None
+        self._synced_length = 0
+        self.compaction = None  # context budget stats of the last response
 
     # hidden helpers
     def _handle_prompt_config(self, prompt_data) -> bool:
@@ -213,38 +587,20 @@ class _Chat:
             return True  # is new lf prompt
         return False  # is lf prompt but not new
 
-    async def _call_tool(self, tool_call) -> dict:
-        tool_function = tool_call["function"]
-        function_name = tool_function["name"]
-
-        if function_name not in self.tools:
-            raise OverlordClientError(f"Tool '{function_name}' not in available tools '{', '.join(self.tools)}'")
-
-        function_to_call = self.tools[function_name]
-        function_args = json.loads(tool_function["arguments"])
+    async def _execute_tool_calls(self, tool_calls):
+        if not self.tools:
+            raise OverlordClientError("No tools to call were provided!")
 
-        # Support both sync and async tools
-        is_async_tool = inspect.iscoroutinefunction(function_to_call)
-        tool_response = await function_to_call(**function_args) if is_async_tool else function_to_call(*function_args)
+        # Execute tools concurrently, failures are answered with error messages for the model
+        tool_tasks = [self._overlord.tool_executor.call(tool_call, self.tools) for tool_call in tool_calls]
+        tool_responses = await asyncio.gather(*tool_tasks)
 
-        return dict(
-            tool_call_id=tool_call["id"],
-            role="tool",
-            name=function_name,
-            content=tool_response if isinstance(tool_response, str) else json.dumps(tool_response),
-        )
+        for tool_response_message in tool_responses:
+            self._message_history.append(tool_response_message)
 
     async def _handle_tool_calls(self, tool_calls):
         if tool_calls:
-            if not self.tools:
-                raise OverlordClientError("No tools to call were provided!")
-
-            # Execute tools concurrently
-            tool_tasks = [self._call_tool(tool_call) for tool_call in tool_calls]
-            tool_responses = await asyncio.gather(*tool_tasks)
-
-            for tool_response_message in tool_responses:
-                self._message_history.append(tool_response_message)
+            await self._execute_tool_calls(tool_calls)
 
             # automatically call itself again with the response of the tools using internal active config
             return await self.request(ChatInput(prompt=None))
@@ -258,43 +614,136 @@ class _Chat:
 
         is_new_lf_prompt = self._handle_prompt_config(prompt_data)
 
+        # the server already knows everything up to the history version
+        history_version = self._history_version
+        message_history = self._message_history[self._synced_length :] if history_version else self._message_history
+
         return ChatRequest(
             lf_prompt_config=self._active_lf_prompt_config or self._initial_lf_prompt_config,
             is_new_lf_prompt=is_new_lf_prompt,
             text_prompt=None if isinstance(prompt_data, dict) else prompt_data,
-            message_history=self._message_history,
+            message_history=message_history,
+            history_version=history_version,
             file_urls=file_urls,
             output_schema=self._initial_response_schema,
+            cache=input_data.cache,
             metadata=dict(session_id=self.session_id, **(dict(custom=custom_metadata) if custom_metadata else {})),
         )
 
+    def _frame(self, request_data, fresh: bool) -> dict:
+        "The full request for a fresh connection, otherwise only what the server session does not hold yet."
+
+        if fresh:
+            return request_data.model_dump()
+
+        frame = request_data.model_dump(exclude={"message_history", "output_schema", "history_version"})
+        frame["message_history"] = self._message_history[self._synced_length :]
+        return frame
+
+    def _send(self, request_data) -> AsyncGenerator:
+        if self._connection:
+            return self._connection.events(lambda fresh: self._frame(request_data, fresh))
+        return self._overlord.client.events(self._endpoint, "POST", request_data.model_dump())
+
+    async def _events(self, request_data) -> AsyncGenerator:
+        try:
+            async for event in self._send(request_data):
+                yield event
+
+        except Exception as e:
+            if request_data.history_version is None or type(e).__name__ != "SessionHistoryMismatch":
+                raise
+
+            # server does not know the session history (anymore) so send it in full
+            self._history_version = None
+            request_data.history_version = None
+            request_data.message_history = self._message_history
+
+            async for event in self._send(request_data):
+                yield event
+
     async def _execute_request(self, request_data):
         try:
-            return await anext(self._overlord.client.request(self._endpoint, "POST", request_data.model_dump()))
+            _, event_data = await anext(self._events(request_data))
+            return event_data
         except:
             self._active_lf_prompt_config = None  # reset for clean retry
             raise
 
-    async def _handle_response(self, response):
+    def _update_state(self, response):
         if not self._message_history:
             self._initial_lf_prompt_config = self._active_lf_prompt_config
             self._initial_response_schema = response["schema"]
 
-        self._message_history = response["messages"]
+        history_offset = response.get("history_offset")
+        if history_offset is None:
+            self._message_history = response["messages"]
+        else:
+            self._message_history = self._message_history[:history_offset] + response["messages"]
+
+        self._history_version = response.get("history_version")
+        self._synced_length = len(self._message_history)
+        self.compaction = response.get("compaction")
+
+    async def _handle_response(self, response):
+        self._update_state(response)
 
         tool_response = await self._handle_tool_calls(response["tool_calls"])
         if tool_response:
             return tool_response
 
-        reply = response["messages"][-1]["content"]
+        reply = self._message_history[-1]["content"]
         return loads_if_json(reply)
 
     # public interface
+    async def close(self):
+        "Close the connection of a persistent chat."
+
+        if self._connection:
+            await self._connection.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
     async def request(self, input_data: ChatInput) -> str | list | dict:
         chat_request = self._prepare_request(input_data)
         response = await self._execute_request(chat_request)
         return await self._handle_response(response)
 
+    async def stream(self, input_data: ChatInput) -> AsyncGenerator[str, None]:
+        """
+        Yields reply text as it is generated.
+
+        Tool calls are executed in between and the follow up reply is streamed as well.
+        """
+
+        chat_request = self._prepare_request(input_data)
+        chat_request.stream = True
+
+        response = None
+        try:
+            async for event_type, event_data in self._events(chat_request):
+                if event_type == "delta" and event_data.get("content"):
+                    yield event_data["content"]
+                elif event_type == "success":
+                    response = event_data
+        except:
+            self._active_lf_prompt_config = None  # reset for clean retry
+            raise
+
+        if not response:
+            raise OverlordClientError("Stream ended without a final response!")
+
+        self._update_state(response)
+
+        if response["tool_calls"]:
+            await self._execute_tool_calls(response["tool_calls"])
+            async for content in self.stream(ChatInput(prompt=None)):
+                yield content
+
 
 # ---
 
@@ -315,15 +764,29 @@ class Overlord:
     # 1. runtime persistant chat
     chat = overlord.chat()  # optionally pass an existing message history
 
+    # or over one websocket for the whole chat (e.g. for tool call loops)
+    async with overlord.chat(persistent=True) as chat:
+        ...
+
     # check session id (optional)
     print(chat.session_id)
 
     data = overlord.input(...)
     response = await chat.request(data)
 
+    # or stream the reply as it is generated
+    async for text in chat.stream(data):
+        print(text, end="")
+
     # 2. single request
     data = overlord.input(...)
     response = await overlord.task(data)
+
+    # 3. many requests with at most `concurrency` running at once
+    async for index, response in overlord.map(inputs):
+        ...  # response is the exception instance if that request failed
+
+    responses = await overlord.gather_tasks(inputs)
     ```
 
     ### Sync Usage:
@@ -345,17 +808,108 @@ class Overlord:
         api_key,
         project,
         *,
-        client_type: Literal["default", "high-usage"] = "default",
+        client_type: Literal["default", "high-usage"] = "default",  # kept for older servers, the tier now comes from the api key
         timeout=60,  # seconds before client requests time out (set higher for longer ai calls)
+        concurrency=10,  # default limit of concurrent bulk requests which also sizes the connection pool
+        retry_policy: RetryPolicy | None = None,  # defaults to RetryPolicy(), RetryPolicy(retries=0) disables retries
+        compression: Literal["gzip", "zstd"] | None = "gzip",  # of request bodies over 1 KB, None for servers without compression
+        tool_executor: ToolExecutor | None = None,  # defaults to ToolExecutor(max_concurrency=concurrency)
     ):
-        self.client = _Client(server, api_key, client_type, timeout)
+        self.client = _Client(
+            server, api_key, client_type, timeout, max_connections=concurrency, retry_policy=retry_policy, compression=compression
+        )
         self.input = ChatInput
         self.project = project
+        self.concurrency = concurrency
+        self.tool_executor = tool_executor or ToolExecutor(max_concurrency=concurrency)
 
-    def chat(self, existing_message_history: list | None = None) -> _Chat:
-        return _Chat(self, existing_message_history)
+    def chat(self, existing_message_history: list | None = None, *, persistent: bool = False) -> _Chat:
+        "A `persistent` chat sends its turns over one websocket, so follow ups only carry new messages (requires websockets)."
+
+        return _Chat(self, existing_message_history, persistent)
 
     async def task(self, data: ChatInput) -> str | list | dict:
         chat = self.chat()
         chat.session_id = None
         return await chat.request(data)
+
+    async def map(
+        self,
+        inputs: Iterable[ChatInput] | AsyncIterable[ChatInput],
+        *,
+        concurrency: int | None = None,
+        ordered: bool = False,
+        return_exceptions: bool = True,
+    ) -> AsyncGenerator[tuple[int, str | list | dict | Exception], None]:
+        """
+        Runs a task per input with at most `concurrency` running at once and yields (index, response).
+
+        - inputs are only pulled when a slot is free so lazily produced inputs are not read ahead
+        - results are yielded as they complete or in input order if `ordered`
+        - a failing input yields its exception instead of aborting the others unless `return_exceptions` is False
+        """
+
+        concurrency = concurrency or self.concurrency
+        iterator = aiter(inputs) if isinstance(inputs, AsyncIterable) else aiter(_as_async_iterable(inputs))
+
+        running = {}  # task -> index
+        finished = {}  # index -> result (only used if ordered)
+        next_index = 0
+        next_to_yield = 0
+        exhausted = False
+
+        try:
+            while True:
+                # fill free slots counting buffered ordered results against the limit for backpressure
+                while not exhausted and len(running) + len(finished) < concurrency:
+                    try:
+                        data = await anext(iterator)
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+
+                    running[asyncio.create_task(self.task(data))] = next_index
+                    next_index += 1
+
+                if not running:
+                    break
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    index = running.pop(task)
+                    if task.exception() and not return_exceptions:
+                        raise task.exception()
+                    result = task.exception() or task.result()
+
+                    if not ordered:
+                        yield index, result
+                    else:
+                        finished[index] = result
+
+                while next_to_yield in finished:
+                    yield next_to_yield, finished.pop(next_to_yield)
+                    next_to_yield += 1
+
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def gather_tasks(
+        self,
+        inputs: Iterable[ChatInput] | AsyncIterable[ChatInput],
+        *,
+        concurrency: int | None = None,
+        return_exceptions: bool = True,
+    ) -> list[str | list | dict | Exception]:
+        "Like asyncio.gather over tasks but with a concurrency limit, returns responses in input order."
+
+        return [
+            response
+            async for _, response in self.map(inputs, concurrency=concurrency, ordered=True, return_exceptions=return_exceptions)
+        ]
+
+
+async def _as_async_iterable(iterable: Iterable):
+    for item in iterable:
+        yield item
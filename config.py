@@ -1,5 +1,5 @@
 from dotenv import load_dotenv
-import litellm, json, os
+import json, os
 
 
 load_dotenv(dotenv_path=".env", override=True)
@@ -7,7 +7,7 @@ load_dotenv(dotenv_path=".env", override=True)
 
 name = os.getenv("APP_NAME", "overlord")
 origins = json.loads(os.getenv("ALLOWED_ORIGINS", "[]"))
-access_keys = json.loads(os.getenv("ACCESS_KEYS", "[]"))
+access_keys = json.loads(os.getenv("ACCESS_KEYS", "[]"))  # list of keys or dict of key -> tier, quota and name
 
 if not access_keys:
     raise ValueError("No access keys are set!")
@@ -25,7 +25,67 @@ rates = {
     "high-usage": rate_limits_high,
 }
 
+key_quota_period = float(os.getenv("KEY_QUOTA_PERIOD", 86400))  # seconds token quotas apply to
+key_usage_flush_interval = float(os.getenv("KEY_USAGE_FLUSH_INTERVAL", 60))
 
-litellm.success_callback = ["langfuse"]
-litellm.failure_callback = ["langfuse"]
-# litellm._turn_on_debug()
+rate_limit_backend = os.getenv("RATE_LIMIT_BACKEND", "")  # "sqlite" or "redis", per process if empty
+rate_limit_backend_url = os.getenv("RATE_LIMIT_BACKEND_URL")  # database path or redis://[:password@]host:port/db
+rate_limit_sync_interval = float(os.getenv("RATE_LIMIT_SYNC_INTERVAL", 0.25))
+rate_limit_backend_timeout = float(os.getenv("RATE_LIMIT_BACKEND_TIMEOUT", 0.5))  # seconds per connect or sync
+
+startup_mode = os.getenv("STARTUP_MODE", "warmup")  # "warmup", "lazy" or "eager" import of litellm and langfuse
+model_cost_map_path = os.getenv("MODEL_COST_MAP_PATH")  # optional json registered on top of litellm's bundled cost map
+
+json_codec = os.getenv("JSON_CODEC", "")  # "orjson" or "json", orjson if installed when empty
+
+compression_min_size = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))  # smaller responses are sent uncompressed
+compression_gzip_level = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+compression_zstd_level = int(os.getenv("COMPRESSION_ZSTD_LEVEL", 3))
+compression_max_request_size = int(os.getenv("COMPRESSION_MAX_REQUEST_SIZE", 50 * 1024 * 1024))  # decompressed bytes
+
+schema_cache_size = int(os.getenv("SCHEMA_CACHE_SIZE", 128))
+prompt_cache_ttl = float(os.getenv("PROMPT_CACHE_TTL", 60))
+prompt_cache_max_stale = float(os.getenv("PROMPT_CACHE_MAX_STALE", 600))
+langfuse_max_workers = int(os.getenv("LANGFUSE_MAX_WORKERS", 8))  # threads for blocking langfuse calls
+
+trace_export = os.getenv("TRACE_EXPORT", "batched")  # "batched", "litellm" (its langfuse callback) or "off"
+trace_queue_size = int(os.getenv("TRACE_QUEUE_SIZE", 10000))  # events kept in memory while langfuse is slow
+trace_batch_size = int(os.getenv("TRACE_BATCH_SIZE", 100))
+trace_flush_interval = float(os.getenv("TRACE_FLUSH_INTERVAL", 2))  # seconds
+trace_drop_policy = os.getenv("TRACE_DROP_POLICY", "oldest")  # dropped when the queue is full: "oldest" or "newest"
+trace_export_timeout = float(os.getenv("TRACE_EXPORT_TIMEOUT", 10))
+trace_shutdown_timeout = float(os.getenv("TRACE_SHUTDOWN_TIMEOUT", 5))  # seconds to send queued events on shutdown
+
+profile_dir = os.getenv("PROFILE_DIR")  # profiles are written here as <request id>.collapsed
+profile_sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", 0))  # fraction of chat requests profiled to PROFILE_DIR
+profile_interval = float(os.getenv("PROFILE_INTERVAL", 0.005))  # seconds between stack samples
+
+admission_max_in_flight = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 0))  # concurrent llm calls, unlimited if 0
+admission_max_in_flight_per_model = json.loads(os.getenv("ADMISSION_MAX_IN_FLIGHT_PER_MODEL", "{}"))
+admission_max_queue = int(os.getenv("ADMISSION_MAX_QUEUE", 100))
+admission_queue_timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 10))
+admission_priorities = json.loads(os.getenv("ADMISSION_PRIORITIES", '{"high-usage": 0, "default": 1}'))
+
+batch_concurrency = int(os.getenv("BATCH_CONCURRENCY", 16))  # max concurrent requests per batch
+batch_max_size = int(os.getenv("BATCH_MAX_SIZE", 1000))
+
+response_cache_size = int(os.getenv("RESPONSE_CACHE_SIZE", 1024))  # completions kept in memory
+response_cache_path = os.getenv("RESPONSE_CACHE_PATH")  # optional sqlite file as persistent tier
+response_cache_ttl = float(os.getenv("RESPONSE_CACHE_TTL", 86400))
+response_cache_max_rows = int(os.getenv("RESPONSE_CACHE_MAX_ROWS", 100000))  # completions kept on disk
+
+compaction_token_cache_size = int(os.getenv("COMPACTION_TOKEN_CACHE_SIZE", 100000))  # token counts of messages
+compaction_summary_cache_size = int(os.getenv("COMPACTION_SUMMARY_CACHE_SIZE", 1000))  # rolling history summaries
+
+attachments_inline = os.getenv("ATTACHMENTS_INLINE", "").lower() in ("1", "true")  # fetch and inline images server-side
+attachment_max_bytes = int(os.getenv("ATTACHMENT_MAX_BYTES", 20 * 1024 * 1024))
+attachment_max_edge = int(os.getenv("ATTACHMENT_MAX_EDGE", 1568))  # pixels of the longest side after downscaling
+attachment_quality = int(os.getenv("ATTACHMENT_QUALITY", 85))  # jpeg quality when re-encoding
+attachment_fetch_timeout = float(os.getenv("ATTACHMENT_FETCH_TIMEOUT", 10))
+attachment_max_connections = int(os.getenv("ATTACHMENT_MAX_CONNECTIONS", 20))
+attachment_cache_size = int(os.getenv("ATTACHMENT_CACHE_SIZE", 256))  # processed images kept in memory
+
+session_store = os.getenv("SESSION_STORE", "")  # "memory" or "sqlite", disabled if empty
+session_store_path = os.getenv("SESSION_STORE_PATH", "sessions.sqlite3")
+session_store_size = int(os.getenv("SESSION_STORE_SIZE", 10000))
+session_ttl = float(os.getenv("SESSION_TTL", 86400))
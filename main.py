@@ -1,26 +1,47 @@
 from fastapi import FastAPI, Response
 
+import config
 from config import name, rates, origins
 
-from src.core import logging
-from src.security import auth, limits, cors
-from src.endpoints import ai, test
+from src.core import logging, middleware, compression, startup, codec
+from src.security import auth, limits, cors, usage
+from src.services import attachments, langfuse, traces
+from src.endpoints import ai, test, stats, metrics
 
 
 app = FastAPI(dependencies=[auth.via_api_key])
 
 
-# setup security middlewares
-cors.setup(app, origins)
-limits.setup(app, rates)
+# setup logging and security middlewares
+usage.setup(app)  # registered first so key usage is flushed before logging stops on shutdown
+traces.setup(app)  # batched langfuse export, queued traces are sent on shutdown (see TRACE_EXPORT)
 logging.setup(app, name)
+codec.setup(app)  # warns if orjson is missing
+limiter = limits.setup(rates, config.rate_limit_backend, config.rate_limit_backend_url, config.rate_limit_sync_interval, config.rate_limit_backend_timeout)
+
+cors.setup(app, origins)
+compression.setup(app)  # gzip or zstd request and response bodies, flushed per event for streams
+middleware.setup(app, limiter)  # request id, timing, rate limits and logs in one outermost layer
+
+attachments.setup(app)  # pooled client for fetching file urls when inlining is enabled
+langfuse.setup(app)  # stops the prompt fetching threads on shutdown
+startup.setup(app)  # import litellm and langfuse in the background once the app runs (see STARTUP_MODE)
 
 
 # include module routers
 app.include_router(ai.router)
 app.include_router(test.router)
+app.include_router(stats.router)
+app.include_router(metrics.router)
 
 
 @app.get("/")
 def health_check():
     return Response(f"{name} is awake")
+
+
+@app.get("/ready")
+def readiness_check():
+    if not startup.ready():
+        return Response(f"{name} is warming up", status_code=503)
+    return Response(f"{name} is ready")
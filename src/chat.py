@@ -1,6 +1,13 @@
-from pydantic import BaseModel
-from src.utils import validation, parsing
-from src.services import langfuse, litellm
+from pydantic import BaseModel, Field
+from typing import TYPE_CHECKING, AsyncGenerator
+from src.utils import validation, parsing, caching
+from src.services import langfuse, litellm, attachments
+from src.core import sessions, metrics, responses, admission, compaction, sse
+from src.security import auth, limits
+import asyncio, config, json, time
+
+if TYPE_CHECKING:
+    from langfuse.model import PromptClient
 
 
 class ChatRequest(BaseModel):
@@ -13,10 +20,26 @@ class ChatRequest(BaseModel):
     file_urls: list[str] | None = None
     output_schema: str | None = None
     metadata: dict
+    stream: bool = False
+    history_version: str | None = None
+    cache: bool | None = None  # overrides the prompt config's "cache" flag
+
+
+class BatchRequest(BaseModel):
+    requests: list[ChatRequest] = Field(min_length=1, max_length=config.batch_max_size)
+    concurrency: int | None = Field(default=None, ge=1)
+
+
+# compiled output schemas keyed by content hash as clients resend the same schema every turn
+schema_cache = caching.LRUCache(config.schema_cache_size)
 
 
 def _handle_structured_output(schema: str) -> type:
     if isinstance(schema, str) and schema.strip():
+        schema_key = caching.content_key(schema)
+        if cached_schema := schema_cache.get(schema_key):
+            return cached_schema
+
         schema_model_class_type = BaseModel
 
         # validate security of input code string
@@ -26,6 +49,7 @@ def _handle_structured_output(schema: str) -> type:
         pydantic_schemas: tuple[type, ...] = parsing.PydanticParser.parse_models(schema, schema_model_class_type)
 
         # needs to be single schema which would use others internally
+        schema_cache.set(schema_key, pydantic_schemas[-1])
         return pydantic_schemas[-1]
 
     raise RuntimeError("Unexpected schema format.")
@@ -79,7 +103,61 @@ def filter_system_prompts(messages: list) -> list:
     return [msg for idx, msg in enumerate(messages) if msg.get("role") != "system" or idx == 0]
 
 
-async def call(data: ChatRequest) -> dict:
+def _metric_labels(params: dict, data: ChatRequest) -> tuple[str, str]:
+    return params.get("model", ""), data.lf_prompt_config.project
+
+
+def _transcript(messages: list[dict]) -> str:
+    lines = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "[image]") for part in content if isinstance(part, dict))
+        if message.get("tool_calls"):
+            content = f"{content or ''} [tool calls: {json.dumps(message['tool_calls'], default=str)}]"
+        lines.append(f"{message.get('role')}: {content}")
+    return "\n".join(lines)
+
+
+async def _summarize(model: str, summary: str | None, messages: list[dict], tracing: dict | None = None) -> str:
+    "Summarize dropped turns into the previous summary for context compaction."
+
+    prompt = (
+        "Summarize the conversation below for continuing it later. Keep facts, decisions, open questions and "
+        "results of tool calls, leave out pleasantries. Reply with the summary only."
+    )
+    transcript = _transcript(messages)
+    if summary:
+        transcript = f"Summary so far:\n{summary}\n\nContinued conversation:\n{transcript}"
+
+    async with admission.admit(model):
+        reply, _, _, tokens = await litellm.async_call(
+            model=model,
+            messages=[dict(role="system", content=prompt), dict(role="user", content=transcript)],
+            **(tracing or {}),
+        )
+
+    auth.record_tokens(tokens)
+    return reply or ""
+
+
+async def _compact(params: dict, message_history: list, budget: dict) -> tuple[list, dict]:
+    budget = compaction.ContextBudget.model_validate(budget)
+    model = params.get("model", "")
+    summary_model = budget.summary_model or model
+    tracing = {key: value for key, value in params.items() if key.startswith("langfuse_")}
+
+    async def summarize(summary, messages):
+        return await _summarize(summary_model, summary, messages, tracing)
+
+    return await compaction.compact(message_history, budget, model, summarize)
+
+
+async def _prepare(
+    data: ChatRequest,
+    lf_prompt: "PromptClient | None" = None,
+    history: tuple[str | None, list[dict]] | None = None,
+) -> tuple[dict, list, str | None, tuple[str | None, int], dict | None]:
     lf_prompt_config = data.lf_prompt_config
     is_new_lf_prompt = data.is_new_lf_prompt
     text_prompt = data.text_prompt
@@ -87,30 +165,54 @@ async def call(data: ChatRequest) -> dict:
     file_urls = data.file_urls
     output_schema = data.output_schema
     metadata = data.metadata
+    history_version = data.history_version
 
     if message_history is None:
         message_history = []
 
+    # continue from the stored session history (or the one a websocket session holds) with the client
+    # only sending messages added since
+    history_base = (None, 0)
+    if history is None and history_version is not None:
+        history = await sessions.load(metadata.get("session_id"), history_version)
+    if history is not None:
+        history_version, stored_history = history
+        history_base = (history_version, len(stored_history))
+        message_history = stored_history + message_history
+
     # --- GET PARAMS FROM LAST LANGFUSE PROMPT PROVIDED
 
-    # get or init client and get prompt object
-    lf_prompt = await langfuse.fetch_prompt(lf_prompt_config)
+    # get or init client and get prompt object unless already fetched (e.g. once per batch)
+    prompt_seconds = None
+    if lf_prompt is None:
+        start_time = time.perf_counter()
+        lf_prompt = await langfuse.fetch_prompt(lf_prompt_config)
+        prompt_seconds = time.perf_counter() - start_time
 
     # extract litellm params
     params = lf_prompt.config.copy()
 
+    labels = _metric_labels(params, data)
+    if prompt_seconds is not None:
+        metrics.chat_stage_seconds.observe(prompt_seconds, "prompt", *labels)
+
     # includes session id (and custom metadata if provided)
     params["metadata"] = metadata
+    # trace to the prompt's langfuse project
+    params.update(langfuse.ClientManager.callback_params(lf_prompt_config.project))
 
     # get previously used output schema from data or a new one from prompt params and remove if exists
     schema_kind = "pydantic_schema"
     new_schema = params.pop(schema_kind, None)
     if schema := output_schema or new_schema:
+        start_time = time.perf_counter()
         params["response_format"] = _handle_structured_output(schema)
+        metrics.chat_stage_seconds.observe(time.perf_counter() - start_time, "schema", *labels)
 
     # ---
 
     # build litellm standardized prompt message history
+    start_time = time.perf_counter()
     message_history += handle_messages(
         params,
         lf_prompt,
@@ -121,16 +223,249 @@ async def call(data: ChatRequest) -> dict:
     )
     message_history = filter_system_prompts(message_history)
     params["messages"] = message_history
+    metrics.chat_stage_seconds.observe(time.perf_counter() - start_time, "messages", *labels)
+
+    # fit what the model gets into the prompt's context budget, the returned history stays complete
+    compaction_stats = None
+    if budget := params.pop(compaction.CONFIG_KEY, None):
+        start_time = time.perf_counter()
+        params["messages"], compaction_stats = await _compact(params, message_history, budget)
+        metrics.chat_stage_seconds.observe(time.perf_counter() - start_time, "compaction", *labels)
+
+    # only the provider gets inlined images, the returned history keeps the urls
+    if attachments.pipeline:
+        start_time = time.perf_counter()
+        params["messages"] = await attachments.pipeline.inline(params["messages"])
+        metrics.chat_stage_seconds.observe(time.perf_counter() - start_time, "attachments", *labels)
+
+    return params, message_history, schema, history_base, compaction_stats
+
+
+async def _finish(
+    data: ChatRequest,
+    message_history: list,
+    assistant_message: dict,
+    tool_calls: list[dict] | None,
+    schema: str | None,
+    history_base: tuple[str | None, int],
+    cached: bool = False,
+    compaction_stats: dict | None = None,
+) -> dict:
+    message_history.append(assistant_message)
 
-    # ---
-
-    reply, tool_calls, response_message = await litellm.async_call(**params)
+    base_version, base_offset = history_base
+    appended = message_history[base_offset:]
+    history_version = await sessions.save(data.metadata.get("session_id"), base_version, message_history, appended)
 
-    assistant_message = response_message.model_dump() if tool_calls else dict(role="assistant", content=reply)
-    message_history.append(assistant_message)
+    # only send back what the client does not have yet if it continued from a history version
+    is_delta = data.history_version is not None or base_offset > 0
 
     return dict(
-        messages=message_history,
-        tool_calls=[tool_call.model_dump() for tool_call in tool_calls] if tool_calls else None,
+        messages=appended if is_delta else message_history,
+        tool_calls=tool_calls,
         schema=schema,  # must return schema to keep the one from initial lf prompt throughout
+        history_version=history_version,
+        history_offset=base_offset if is_delta else None,
+        cached=cached,
+        compaction=compaction_stats,
     )
+
+
+async def _cached_reply(params: dict, data: ChatRequest) -> tuple[str | None, tuple | None]:
+    "Returns the cache key if caching applies and the cached (assistant_message, tool_calls) if there is one."
+
+    cache_key = responses.key_for(params, data.cache)
+    if not cache_key:
+        return None, None
+    return cache_key, await responses.response_cache.get(cache_key)
+
+
+async def call(data: ChatRequest, lf_prompt: "PromptClient | None" = None, history: tuple[str | None, list[dict]] | None = None) -> dict:
+    params, message_history, schema, history_base, compaction_stats = await _prepare(data, lf_prompt, history)
+
+    cache_key, cached = await _cached_reply(params, data)
+    if cached:
+        return await _finish(data, message_history, *cached, schema, history_base, cached=True, compaction_stats=compaction_stats)
+
+    model, project = _metric_labels(params, data)
+    async with admission.admit(model):
+        metrics.llm_calls_in_flight.inc(model)
+        start_time = time.perf_counter()
+        try:
+            reply, tool_calls, response_message, tokens = await litellm.async_call(**params)
+        finally:
+            metrics.llm_calls_in_flight.dec(model)
+            metrics.chat_stage_seconds.observe(time.perf_counter() - start_time, "llm", model, project)
+
+    auth.record_tokens(tokens)
+
+    assistant_message = response_message.model_dump() if tool_calls else dict(role="assistant", content=reply)
+    tool_calls = [tool_call.model_dump() for tool_call in tool_calls] if tool_calls else None
+
+    if cache_key:
+        await responses.response_cache.set(cache_key, (assistant_message, tool_calls))
+
+    return await _finish(data, message_history, assistant_message, tool_calls, schema, history_base, compaction_stats=compaction_stats)
+
+
+async def stream(data: ChatRequest, lf_prompt: "PromptClient | None" = None, history: tuple[str | None, list[dict]] | None = None) -> AsyncGenerator:
+    "Yields delta events while the model generates and ends with the same success payload as call."
+
+    params, message_history, schema, history_base, compaction_stats = await _prepare(data, lf_prompt, history)
+
+    cache_key, cached = await _cached_reply(params, data)
+    if cached:
+        assistant_message, tool_calls = cached
+        if assistant_message.get("content"):
+            yield "delta", dict(content=assistant_message["content"])
+        yield "success", await _finish(
+            data, message_history, assistant_message, tool_calls, schema, history_base, cached=True, compaction_stats=compaction_stats
+        )
+        return
+
+    model, project = _metric_labels(params, data)
+    async with admission.admit(model):
+        metrics.llm_calls_in_flight.inc(model)
+        start_time = time.perf_counter()
+        try:
+            collector = litellm.StreamCollector()
+            async for chunk in litellm.async_stream(**params):
+                if event_data := collector.add(chunk):
+                    yield "delta", event_data
+        finally:
+            metrics.llm_calls_in_flight.dec(model)
+            metrics.chat_stage_seconds.observe(time.perf_counter() - start_time, "llm", model, project)
+
+    auth.record_tokens(collector.tokens)
+    reply, tool_calls, response_message = collector.result()
+
+    assistant_message = response_message if tool_calls else dict(role="assistant", content=reply)
+
+    if cache_key:
+        await responses.response_cache.set(cache_key, (assistant_message, tool_calls))
+
+    yield "success", await _finish(data, message_history, assistant_message, tool_calls, schema, history_base, compaction_stats=compaction_stats)
+
+
+async def batch(data: BatchRequest) -> AsyncGenerator:
+    """
+    Runs chat requests concurrently and yields an item event per request as it completes.
+
+    Each distinct prompt config is fetched once for the whole batch and output schemas are compiled
+    once through the schema cache. A failing request only produces an error for its own item.
+Every item counts against rate limits and token quotas like a request of its own.
+    """
+
+    semaphore = asyncio.Semaphore(min(data.concurrency or config.batch_concurrency, config.batch_concurrency))
+    prompts = {}  # prompt cache key -> shared fetch
+
+    def fetch_once(prompt_config: langfuse.PromptConfig) -> asyncio.Future:
+        key = langfuse.PromptCache.key(prompt_config)
+        if key not in prompts:
+            prompts[key] = asyncio.ensure_future(langfuse.fetch_prompt(prompt_config))
+        return prompts[key]
+
+    async def run(index: int, request: ChatRequest) -> dict:
+        async with semaphore:
+            try:
+                if api_key:
+                    auth.check_quota(api_key)
+                lf_prompt = await fetch_once(request.lf_prompt_config)
+                return dict(index=index, result=await call(request, lf_prompt))
+            except Exception as e:
+                return dict(index=index, error=sse.error_data(e))
+
+    # every item counts as a request, the batch request itself was charged as the first
+    await limits.charge(len(data.requests) - 1)
+    api_key = auth.api_key_context.get()
+
+    tasks = [asyncio.create_task(run(index, request)) for index, request in enumerate(data.requests)]
+
+    failed = 0
+    try:
+        for next_completed in asyncio.as_completed(tasks):
+            item = await next_completed
+            failed += "error" in item
+            yield "item", item
+
+    finally:
+        # stop remaining work if the client disconnects
+        for task in tasks:
+            task.cancel()
+
+    yield "success", dict(total=len(tasks), failed=failed)
+
+
+class ChatTurn(BaseModel):
+    """
+    A turn on a websocket chat connection.
+
+    Only the first turn needs the prompt config and metadata, later ones reuse them unless they
+    change them. `message_history` holds the messages added since the last response (like tool
+    results) or the full history on the first turn unless it continues from a `history_version`.
+    """
+
+    lf_prompt_config: langfuse.PromptConfig | None = None
+    is_new_lf_prompt: bool = False
+    # ---
+    text_prompt: str | None = None
+    message_history: list[dict] | None = None
+    # ---
+    file_urls: list[str] | None = None
+    output_schema: str | None = None
+    metadata: dict | None = None
+    stream: bool = False
+    history_version: str | None = None
+    cache: bool | None = None
+
+
+class ChatSession:
+    """
+    Chat state kept for the life of a websocket connection.
+
+    The message history and its version stay in memory between turns, so turns do not resend the
+    history, and prompts come from the shared prompt cache. Responses only contain the messages
+    added since `history_offset`, like responses to requests continuing from a history version.
+    """
+
+    CARRIED = ("lf_prompt_config", "output_schema", "metadata")  # turn fields kept for following turns
+
+    def __init__(self):
+        self.history = None  # (version, messages) as of the last response
+        self._settings = {}
+
+    def _update(self, history: tuple[str | None, list[dict]] | None, result: dict):
+        messages = result["messages"]
+        if result["history_offset"] is not None:
+            messages = history[1][: result["history_offset"]] + messages
+
+        self.history = result["history_version"], messages
+        # keep the schema of the initial prompt throughout like clients do
+        self._settings.setdefault("output_schema", result["schema"])
+
+    async def turn(self, turn: ChatTurn) -> AsyncGenerator:
+        "Yields the (event_type, event_data) pairs of one turn, the same events the chat endpoint streams."
+
+        if api_key := auth.api_key_context.get():
+            auth.check_quota(api_key)
+
+        changed = turn.model_dump(include=set(self.CARRIED), exclude_none=True)
+        self._settings.update(changed)
+        data = ChatRequest.model_validate(dict(turn.model_dump(exclude=set(self.CARRIED)), **self._settings))
+
+        history = self.history
+        if history is None and data.history_version is not None:
+            history = await sessions.load(data.metadata.get("session_id"), data.history_version)
+
+        lf_prompt = await langfuse.fetch_prompt(data.lf_prompt_config)
+
+        if not data.stream:
+            result = await call(data, lf_prompt, history)
+            self._update(history, result)
+            yield "success", result
+            return
+
+        async for event_type, event_data in stream(data, lf_prompt, history):
+            if event_type == "success":
+                self._update(history, event_data)
+            yield event_type, event_data
@@ -0,0 +1,149 @@
+from contextlib import asynccontextmanager, nullcontext
+from contextvars import ContextVar
+from bisect import insort
+import asyncio, itertools, time
+
+from src.core import metrics
+import config
+
+
+# HELPER
+
+client_type_context = ContextVar("client_type", default="default")
+
+
+class ServiceOverloaded(Exception):
+    "Raised if a request is shed because the LLM call queue is full or waiting took too long."
+
+    status_code = 503
+    retry_after = 1  # seconds
+
+
+class AdmissionController:
+    """
+    Caps concurrent LLM calls globally and per model.
+
+    Calls over the cap wait in a bounded queue ordered by client type priority (lower value first,
+    then arrival). Calls are shed with ServiceOverloaded if the queue is full or if they waited
+    longer than `queue_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_in_flight_per_model: dict[str, int],
+        max_queue: int,
+        queue_timeout: float,
+        priorities: dict[str, int],
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_model = max_in_flight_per_model
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.priorities = priorities
+        # ---
+        self.in_flight = 0
+        self._in_flight_per_model = {}
+        self._waiters = []  # sorted (priority, sequence, model, future)
+        self._sequence = itertools.count()
+
+    def _priority(self, client_type: str) -> int:
+        return self.priorities.get(client_type, max(self.priorities.values(), default=0))
+
+    def _has_capacity(self, model: str) -> bool:
+        if self.in_flight >= self.max_in_flight:
+            return False
+        model_limit = self.max_in_flight_per_model.get(model)
+        return model_limit is None or self._in_flight_per_model.get(model, 0) < model_limit
+
+    def _take(self, model: str):
+        self.in_flight += 1
+        self._in_flight_per_model[model] = self._in_flight_per_model.get(model, 0) + 1
+
+    def _release(self, model: str):
+        self.in_flight -= 1
+        self._in_flight_per_model[model] -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        "Hand free slots to the highest priority waiters whose model has capacity."
+
+        for waiter in list(self._waiters):
+            if self.in_flight >= self.max_in_flight:
+                break
+
+            _, _, model, future = waiter
+            if future.done() or not self._has_capacity(model):
+                continue
+
+            self._waiters.remove(waiter)
+            self._take(model)
+            future.set_result(None)
+
+    async def _acquire(self, model: str, client_type: str):
+        if not self._waiters and self._has_capacity(model):
+            self._take(model)
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            metrics.admission_shed.inc(client_type, "queue_full")
+            raise ServiceOverloaded("Too many requests waiting for the model, try again later")
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (self._priority(client_type), next(self._sequence), model, future)
+        insort(self._waiters, waiter, key=lambda w: w[:2])
+        self._dispatch()  # waiters ahead may only be blocked by their own model's limit
+
+        metrics.admission_queue_depth.inc(client_type)
+        start_time = time.perf_counter()
+        admitted = False
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+            admitted = True
+
+        except asyncio.TimeoutError:
+            metrics.admission_shed.inc(client_type, "queue_timeout")
+            raise ServiceOverloaded(f"Waited longer than {self.queue_timeout} seconds for the model, try again later")
+
+        finally:
+            metrics.admission_queue_depth.dec(client_type)
+            metrics.admission_wait_seconds.observe(time.perf_counter() - start_time, client_type)
+
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif not admitted and future.done() and not future.cancelled():
+                self._release(model)  # a slot was handed over just as the wait was given up
+
+    @asynccontextmanager
+    async def admit(self, model: str, client_type: str):
+        await self._acquire(model, client_type)
+        try:
+            yield
+        finally:
+            self._release(model)
+
+
+# INIT
+
+controller = (
+    AdmissionController(
+        config.admission_max_in_flight,
+        config.admission_max_in_flight_per_model,
+        config.admission_max_queue,
+        config.admission_queue_timeout,
+        config.admission_priorities,
+    )
+    if config.admission_max_in_flight > 0
+    else None
+)
+
+
+# INTERFACE
+
+
+def admit(model: str):
+    "Context manager holding an LLM call slot for the current request's client type (no-op if disabled)."
+
+    if not controller:
+        return nullcontext()
+    return controller.admit(model, client_type_context.get())
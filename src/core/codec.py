@@ -0,0 +1,74 @@
+from fastapi import FastAPI, Request
+from fastapi.routing import APIRoute
+from typing import Any, Callable
+import json
+
+from src.core import logging
+import config
+
+try:
+    import orjson
+except ImportError:  # stdlib json is used without orjson
+    orjson = None
+
+
+# HELPER
+
+CODECS = ("orjson", "json")
+name = config.json_codec or ("orjson" if orjson else "json")
+
+if name not in CODECS:
+    raise ValueError(f"Unknown json codec '{name}', expected one of: {', '.join(CODECS)}")
+if name == "orjson" and not orjson:
+    raise ValueError("JSON_CODEC is 'orjson' but orjson is not installed")
+
+
+# INIT
+
+
+def setup(app: FastAPI):
+    if name == "json" and not config.json_codec:
+        logging.get_logger().warning("orjson is not installed, json is encoded and decoded with the slower stdlib json")
+
+
+# INTERFACE
+
+
+def dumps_bytes(data: Any) -> bytes:
+    "Compact utf-8 json bytes, falling back to stdlib for values orjson rejects (like integers over 64 bit)."
+
+    if name == "orjson":
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def dumps(data: Any) -> str:
+    return dumps_bytes(data).decode()
+
+
+def loads(data: str | bytes) -> Any:
+    if name == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class CodecRequest(Request):
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = loads(await self.body())
+        return self._json
+
+
+class CodecRoute(APIRoute):
+    "Route parsing json request bodies with the configured codec."
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def codec_handler(request: Request):
+            return await handler(CodecRequest(request.scope, request.receive))
+
+        return codec_handler
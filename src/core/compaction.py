@@ -0,0 +1,148 @@
+from pydantic import BaseModel, Field
+from typing import Awaitable, Callable, Literal
+import json
+
+from src.utils import caching
+from src.core import sessions
+from src.services import litellm
+import config
+
+
+# DATA
+
+
+class ContextBudget(BaseModel):
+    """Langfuse prompt config entry ("context_budget") limiting the tokens of the history sent to the model."""
+
+    max_tokens: int = Field(gt=0)
+    keep_turns: int = Field(default=4, ge=1)  # latest turns (starting at a user message) that are always sent
+    strategy: Literal["drop", "summarize"] = "drop"
+    summary_model: str | None = None  # defaults to the prompt's model
+
+
+# HELPER
+
+CONFIG_KEY = "context_budget"
+IMAGE_TOKENS = 1000  # rough flat estimate per image part instead of fetching it for its size
+MESSAGE_TOKENS = 4  # per message overhead of chat formats
+
+# token counts keyed by model and message content as the same messages are resent every turn
+token_cache = caching.LRUCache(config.compaction_token_cache_size)
+# rolling summaries keyed by the hash chain over the messages they replace
+summary_cache = caching.LRUCache(config.compaction_summary_cache_size)
+
+
+def _count_tokens(model: str, message: dict) -> int:
+    content = message.get("content")
+    parts = content if isinstance(content, list) else [dict(type="text", text=content or "")]
+
+    texts, images = [], 0
+    for part in parts:
+        if isinstance(part, dict) and part.get("type") == "image_url":
+            images += 1
+        elif isinstance(part, dict):
+            texts.append(str(part.get("text") or ""))
+
+    if message.get("tool_calls"):
+        texts.append(json.dumps(message["tool_calls"], default=str))
+
+    text = "\n".join(texts)
+    text_tokens = litellm.provider().token_counter(model=model, text=text) if text else 0
+    return MESSAGE_TOKENS + text_tokens + images * IMAGE_TOKENS
+
+
+def message_tokens(model: str, message: dict) -> int:
+    key = caching.content_key(f"{model}\n{json.dumps(message, sort_keys=True, default=str)}")
+    if (tokens := token_cache.get(key)) is None:
+        tokens = _count_tokens(model, message)
+        token_cache.set(key, tokens)
+    return tokens
+
+
+def _turn_starts(messages: list[dict], start: int) -> list[int]:
+    return [index for index in range(start, len(messages)) if messages[index].get("role") == "user"]
+
+
+def _with_summary(system: dict | None, summary: str) -> dict:
+    note = f"Summary of the earlier conversation:\n{summary}"
+    if system and isinstance(system.get("content"), str):
+        return dict(system, content=f"{system['content']}\n\n{note}")
+    if system and isinstance(system.get("content"), list):  # content parts keep the prompt's parts like cache control
+        return dict(system, content=[*system["content"], dict(type="text", text=note)])
+    return dict(role="system", content=note)
+
+
+async def _rolling_summary(dropped: list[dict], summarize: Callable[[str | None, list[dict]], Awaitable[str]]) -> str:
+    "Extend the summary of the longest already summarized prefix of the dropped messages."
+
+    chain = [None]
+    for message in dropped:
+        chain.append(sessions.advance_version(chain[-1], [message]))
+
+    summarized, summary = 0, None
+    for length in range(len(dropped), 0, -1):
+        if (cached := summary_cache.get(chain[length])) is not None:
+            summarized, summary = length, cached
+            break
+
+    if summarized < len(dropped):
+        summary = await summarize(summary, dropped[summarized:])
+        summary_cache.set(chain[-1], summary)
+
+    return summary
+
+
+# INTERFACE
+
+
+async def compact(
+    messages: list[dict],
+    budget: ContextBudget,
+    model: str,
+    summarize: Callable[[str | None, list[dict]], Awaitable[str]],
+) -> tuple[list[dict], dict]:
+    """
+    Fit messages into the token budget by dropping the oldest turns, keeping the system prompt and the latest turns.
+
+    With the "summarize" strategy the dropped turns are replaced by a rolling summary appended to the
+    system prompt. Returns the messages to send and the compaction stats.
+    """
+
+    counts = [message_tokens(model, message) for message in messages]
+    tokens_before = sum(counts)
+
+    stats = dict(budget=budget.max_tokens, tokens_before=tokens_before, tokens_after=tokens_before, dropped_messages=0, summarized=False)
+    if tokens_before <= budget.max_tokens:
+        return messages, stats
+
+    system = messages[0] if messages and messages[0].get("role") == "system" else None
+    first = 1 if system else 0
+    turn_starts = _turn_starts(messages, first)
+    cut_points = [start for start in turn_starts[: max(len(turn_starts) - budget.keep_turns + 1, 0)] if start > first]
+
+    # drop as few of the older turns as needed
+    cut, tokens = first, tokens_before
+    for start in cut_points:
+        tokens -= sum(counts[cut:start])
+        cut = start
+        if tokens <= budget.max_tokens:
+            break
+
+    dropped = messages[first:cut]
+    if not dropped:
+        return messages, stats
+
+    kept = messages[cut:]
+    head = [system] if system else []
+
+    if budget.strategy == "summarize":
+        summary = await _rolling_summary(dropped, summarize)
+        head = [_with_summary(system, summary)]
+        stats["summarized"] = True
+
+    compacted = head + kept
+    stats.update(
+        tokens_after=sum(message_tokens(model, message) for message in head) + sum(counts[cut:]),
+        dropped_messages=len(dropped),
+    )
+    return compacted, stats
@@ -0,0 +1,181 @@
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Scope, Receive, Send
+import io, zlib
+
+import config
+
+try:
+    import zstandard
+except ImportError:  # only gzip is offered without zstandard
+    zstandard = None
+
+
+# HELPER
+
+ENCODINGS = ("zstd", "gzip") if zstandard else ("gzip",)  # server preference
+
+
+class RequestBodyError(ValueError):
+    "Raised if a compressed request body is unsupported, invalid or decompresses beyond the size limit."
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _compressor(encoding: str):
+    "Returns (compress, flush, finish) functions of a streaming compressor."
+
+    if encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=config.compression_zstd_level).compressobj()
+        return (
+            compressor.compress,
+            lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+            lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH),
+        )
+
+    compressor = zlib.compressobj(config.compression_gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def decompress(body: bytes, encoding: str, max_size: int) -> bytes:
+    try:
+        if encoding == "zstd":
+            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as reader:
+                decompressed = reader.read(max_size + 1)
+        else:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)  # gzip or zlib header
+            decompressed = decompressor.decompress(body, max_size + 1)
+    except (zlib.error, getattr(zstandard, "ZstdError", zlib.error)) as e:
+        raise RequestBodyError(f"Invalid {encoding} request body: {e}")
+
+    if len(decompressed) > max_size:
+        raise RequestBodyError(f"Request body exceeds {max_size} bytes", 413)
+    return decompressed
+
+
+def negotiate(accept_encoding: str) -> str | None:
+    "Pick the preferred encoding the client accepts (ignoring q=0)."
+
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        encoding, _, params = item.strip().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(encoding.strip())
+
+    return next((encoding for encoding in ENCODINGS if encoding in accepted or "*" in accepted), None)
+
+
+def _is_compressible(content_type: str) -> bool:
+    return content_type.startswith("text/") or "json" in content_type
+
+
+class CompressionMiddleware:
+    """
+    Pure ASGI middleware decompressing gzip or zstd request bodies and compressing responses.
+
+    Streamed responses (like SSE) are flushed after every body message so each event reaches the
+    client as soon as it is sent instead of waiting for the compressor's buffer to fill.
+    """
+
+    def __init__(self, app: ASGIApp, min_size: int = 1024, max_request_size: int = 50 * 1024 * 1024):
+        self.app = app
+        self.min_size = min_size
+        self.max_request_size = max_request_size
+
+    async def _read_body(self, receive: Receive) -> bytes:
+        chunks, more_body = [], True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        return b"".join(chunks)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        headers = Headers(scope=scope)
+
+        # REQUEST
+        request_encoding = headers.get("content-encoding", "identity").strip().lower()
+        if request_encoding != "identity":
+            try:
+                if request_encoding not in ENCODINGS:
+                    raise RequestBodyError(f"Unsupported content encoding: {request_encoding}", 415)
+                body = decompress(await self._read_body(receive), request_encoding, self.max_request_size)
+
+            except RequestBodyError as e:
+                response = JSONResponse(status_code=e.status_code, content={"detail": str(e)}, headers={"Accept-Encoding": ", ".join(ENCODINGS)})
+                return await response(scope, receive, send)
+
+            scope = dict(scope, headers=[(k, v) for k, v in scope["headers"] if k not in (b"content-encoding", b"content-length")])
+            scope["headers"].append((b"content-length", str(len(body)).encode()))
+            receive = _replay(body, receive)
+
+        # RESPONSE
+        if not (response_encoding := negotiate(headers.get("accept-encoding", ""))):
+            return await self.app(scope, receive, send)
+
+        start_message = None
+        compressor = None
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor
+
+            if message["type"] == "http.response.start":
+                start_message = message  # sent with the first body once it is known whether to compress
+                return
+
+            if message["type"] != "http.response.body":
+                return await send(message)
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start_message is not None:
+                response_headers = MutableHeaders(scope=start_message)
+                if (
+                    "content-encoding" not in response_headers
+                    and _is_compressible(response_headers.get("content-type", ""))
+                    and (more_body or len(body) >= self.min_size)
+                ):
+                    compressor = _compressor(response_encoding)
+                    del response_headers["content-length"]
+                    response_headers["content-encoding"] = response_encoding
+                    response_headers.add_vary_header("Accept-Encoding")
+
+                await send(start_message)
+                start_message = None
+
+            if compressor:
+                compress, flush, finish = compressor
+                body = compress(body) + (flush() if more_body else finish())
+                message = dict(message, body=body)
+
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def _replay(body: bytes, receive: Receive) -> Receive:
+    "Receive the already read body once, then pass through (e.g. to notice disconnects)."
+
+    sent = False
+
+    async def replay_receive():
+        nonlocal sent
+        if sent:
+            return await receive()
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return replay_receive
+
+
+def setup(app: FastAPI):
+    app.add_middleware(CompressionMiddleware, min_size=config.compression_min_size, max_request_size=config.compression_max_request_size)
@@ -1,12 +1,15 @@
-from fastapi import FastAPI, Request
-from starlette.middleware.base import BaseHTTPMiddleware
+from fastapi import FastAPI
+from logging.handlers import QueueHandler, QueueListener
 from contextvars import ContextVar
-import logging, json, time, uuid
+import logging, queue
+
+from src.core import codec
 
 
 # HELPER
 
 logger = None
+listener = None
 
 request_id_context = ContextVar("request_id", default=None)
 
@@ -24,75 +27,38 @@ class JsonFormatter(logging.Formatter):
             method=getattr(record, "method", None),
             status=getattr(record, "status", None),
             ms=getattr(record, "ms", None),
+            usage=getattr(record, "usage", None),
         )
 
         log_data_clean = {k: v for k, v in log_data.items() if v}
-        return json.dumps(log_data_clean)
-
-
-class LoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        req_id = str(uuid.uuid4())
-        request_id_context.set(req_id)
-        start_time = time.time()
-
-        # REQUEST
-        request_info = dict(
-            method=request.method,
-            endpoint=request.url.path,
-        )
-        logger.info(f"Request", extra=request_info)
-
-        try:
-            # CALL
-            response = await call_next(request)
-            process_time = round((time.time() - start_time) * 1000)
-
-            # change level depending on status
-            if response.status_code >= 500:
-                log_method = logger.error
-            elif response.status_code >= 400:
-                log_method = logger.warning
-            else:
-                log_method = logger.info
-
-            # RESPONSE
-            response_info = dict(
-                method=request.method,
-                endpoint=request.url.path,
-                status=response.status_code,
-                ms=process_time,
-            )
-            log_method(f"Response", extra=response_info)
-            return response
-
-        except Exception as e:
-            process_time = round((time.time() - start_time) * 1000)
-
-            # ERROR
-            error_info = dict(
-                method=request.method,
-                endpoint=request.url.path,
-                ms=process_time,
-            )
-            logger.error(f"Error: {str(e)}", exc_info=True, extra=error_info)
-            raise
+        return codec.dumps(log_data_clean)
 
 
 # INIT
 
 
 def setup(app: FastAPI, name: str):
-    global logger
+    """
+    Log records are formatted where they are emitted (so the request id context is available)
+    and written to stdout by a background listener thread so the event loop never blocks on I/O.
+    """
+
+    global logger, listener
 
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
 
-    handler = logging.StreamHandler()
-    handler.setFormatter(JsonFormatter())
-    logger.addHandler(handler)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(JsonFormatter())
+    logger.addHandler(queue_handler)
 
-    app.add_middleware(LoggingMiddleware)
+    listener = QueueListener(log_queue, stream_handler)
+    listener.start()
+    app.add_event_handler("shutdown", listener.stop)
 
 
 def get_logger():
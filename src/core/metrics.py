@@ -0,0 +1,205 @@
+from bisect import bisect_left
+from typing import Callable
+
+
+# HELPER
+
+REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """
+    Base for metrics in the Prometheus text format.
+
+    Label values are passed positionally in the order of `labelnames`. Updates are plain dict and
+    number operations without locks, which is safe on the event loop and at worst loses a
+    sample when called from several threads at once.
+    """
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}" for labels, value in self._values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+
+class CallbackGauge(_Metric):
+    """Gauge whose samples are computed at scrape time as a mapping of label values to value."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...], callback: Callable[[], dict]):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def _samples(self):
+        self._values = self.callback()
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels):
+        if not (state := self._values.get(labels)):
+            # per bucket counts (last one is +Inf), sum, count
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def _samples(self):
+        samples = []
+
+        for labels, (bucket_counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), bucket_counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                samples.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+
+            samples.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            samples.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+
+        return samples
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+# METRICS
+
+chat_stage_seconds = Histogram(
+    "overlord_chat_stage_seconds",
+    "Time spent per chat pipeline stage (prompt, schema, messages, compaction, attachments, llm).",
+    ("stage", "model", "project"),
+)
+sse_serialize_seconds = Histogram(
+    "overlord_sse_serialize_seconds",
+    "Time spent serializing SSE event data.",
+    ("event",),
+)
+sse_error_events = Counter(
+    "overlord_sse_error_events_total",
+    "Error events emitted by SSE endpoints, batch items and websocket turns.",
+    ("type",),
+)
+rate_limit_rejections = Counter(
+    "overlord_rate_limit_rejections_total",
+    "Requests rejected by the rate limiter.",
+    ("client_type", "limit"),
+)
+auth_failures = Counter(
+    "overlord_auth_failures_total",
+    "Requests with an invalid API key.",
+)
+requests_in_flight = Gauge(
+    "overlord_requests_in_flight",
+    "HTTP requests currently being handled.",
+)
+websocket_connections = Gauge(
+    "overlord_websocket_connections",
+    "Open websocket chat connections.",
+)
+websocket_turns = Counter(
+    "overlord_websocket_turns_total",
+    "Chat turns handled over websocket connections by result.",
+    ("result",),
+)
+llm_calls_in_flight = Gauge(
+    "overlord_llm_calls_in_flight",
+    "LLM provider calls currently running.",
+    ("model",),
+)
+admission_queue_depth = Gauge(
+    "overlord_admission_queue_depth",
+    "Requests waiting for an LLM call slot.",
+    ("client_type",),
+)
+admission_wait_seconds = Histogram(
+    "overlord_admission_wait_seconds",
+    "Time queued requests waited for an LLM call slot.",
+    ("client_type",),
+)
+admission_shed = Counter(
+    "overlord_admission_shed_total",
+    "Requests shed by admission control.",
+    ("client_type", "reason"),
+)
+key_requests = Counter(
+    "overlord_key_requests_total",
+    "Authenticated requests per API key.",
+    ("key",),
+)
+key_tokens = Counter(
+    "overlord_key_tokens_total",
+    "LLM tokens used per API key.",
+    ("key",),
+)
+trace_events = Counter(
+    "overlord_trace_events_total",
+    "Langfuse trace events by outcome (exported, dropped, failed, skipped without keys).",
+    ("outcome",),
+)
+trace_flushes = Counter(
+    "overlord_trace_flushes_total",
+    "Langfuse trace export requests by result.",
+    ("result",),
+)
+trace_queue_depth = Gauge(
+    "overlord_trace_queue_depth",
+    "Langfuse trace events waiting to be exported.",
+)
+trace_export_seconds = Histogram(
+    "overlord_trace_export_seconds",
+    "Time spent sending a batch of trace events to Langfuse.",
+)
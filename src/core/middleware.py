@@ -0,0 +1,122 @@
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Scope, Receive, Send
+import time, uuid
+
+from src.core import logging, metrics, admission
+from src.security import auth, limits
+from src.security.limits import RateLimiter
+
+
+class RequestMiddleware:
+    """
+    Pure ASGI middleware handling request id context, timing, rate limiting and logging in one layer.
+
+    Unlike BaseHTTPMiddleware it passes messages straight through, so streamed responses are not
+    wrapped in extra tasks and memory streams. Websocket connections are limited when they connect
+    and per turn after the first (see ws.serve), and logged when they close.
+    """
+
+    def __init__(self, app: ASGIApp, limiter: RateLimiter | None = None):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        is_websocket = scope["type"] == "websocket"
+
+        logger = logging.get_logger()
+        logging.request_id_context.set(str(uuid.uuid4()))
+        start_time = time.perf_counter()
+
+        # REQUEST
+        request_info = dict(
+            method=scope.get("method", "WEBSOCKET"),
+            endpoint=scope["path"],
+        )
+        logger.info(f"Request", extra=request_info)
+
+        # the tier comes from the api key, requests without a valid one are limited per ip
+        api_key = auth.lookup(Headers(scope=scope).get("x-api-key"))
+        client_type = api_key.tier if api_key else "default"
+        admission.client_type_context.set(client_type)
+
+        # LIMIT
+        rate_limit_status = None
+        if self.limiter:
+            if api_key:
+                client_id = f"key:{api_key.id}"
+            else:
+                client = scope.get("client")
+                client_id = f"ip:{client[0] if client else 'unknown'}"
+
+            rate_limit_status = await self.limiter.check(client_id, client_type)
+            # for work charged within the request (see limits.charge), a websocket's handshake counts as its first turn
+            limits.client_context.set((self.limiter, client_id, client_type))
+
+        if rate_limit_status and rate_limit_status.exceeded:
+            metrics.rate_limit_rejections.inc(client_type, rate_limit_status.exceeded)
+            # starlette sends responses to websockets as a denial of the handshake
+            app = JSONResponse(
+                status_code=429,
+                content={"detail": f"Rate limit exceeded: {rate_limit_status.exceeded}"},
+                headers=rate_limit_status.headers(),
+            )
+        else:
+            app = self.app
+
+        status_code = None
+
+        async def send_wrapper(message):
+            nonlocal status_code
+
+            if message["type"] in ("http.response.start", "websocket.http.response.start"):
+                status_code = message["status"]
+                if rate_limit_status and not rate_limit_status.exceeded:
+                    MutableHeaders(scope=message).update(rate_limit_status.headers())
+            elif message["type"] == "websocket.accept":
+                status_code = 101
+            elif message["type"] == "websocket.close" and status_code is None:
+                status_code = 403  # closed before accepting is a rejected handshake
+
+            await send(message)
+
+        in_flight = metrics.websocket_connections if is_websocket else metrics.requests_in_flight
+        in_flight.inc()
+        try:
+            # CALL
+            await app(scope, receive, send_wrapper)
+
+        except Exception as e:
+            # ERROR
+            error_info = dict(
+                **request_info,
+                ms=round((time.perf_counter() - start_time) * 1000),
+            )
+            logger.error(f"Error: {str(e)}", exc_info=True, extra=error_info)
+            raise
+
+        finally:
+            in_flight.dec()
+
+        # change level depending on status
+        if status_code is None or status_code >= 500:
+            log_method = logger.error
+        elif status_code >= 400:
+            log_method = logger.warning
+        else:
+            log_method = logger.info
+
+        # RESPONSE (after the body is sent so streamed responses and websockets are timed completely)
+        response_info = dict(
+            **request_info,
+            status=status_code,
+            ms=round((time.perf_counter() - start_time) * 1000),
+        )
+        log_method(f"Response", extra=response_info)
+
+
+def setup(app: FastAPI, limiter: RateLimiter | None = None):
+    app.add_middleware(RequestMiddleware, limiter=limiter)
@@ -0,0 +1,188 @@
+from fastapi import Header, HTTPException, status
+from starlette.concurrency import run_in_threadpool
+from collections import Counter
+from contextvars import ContextVar
+from typing import AsyncGenerator, Awaitable
+import os, random, sys, threading, time
+
+from src.core import logging
+from src.security import auth
+import config
+
+
+# HELPER
+
+RETURN = "return"  # requested by an admin key, sent back with the success event
+WRITE = "write"  # sampled, only written to PROFILE_DIR
+
+profile_context = ContextVar("profile", default=None)
+
+
+def _label(code) -> str:
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _await_chain(awaitable) -> list[str]:
+    "Labels of the coroutines and async generators a suspended one waits in, outermost first."
+
+    labels = []
+    while awaitable is not None:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "ag_frame", None)
+        if frame is None:
+            break
+        labels.append(_label(frame.f_code))
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "ag_await", None)
+    return labels
+
+
+class Sampler:
+    """
+    Samples the stack of one coroutine or async generator every `interval` seconds from a thread.
+
+    While it runs on the event loop the loop thread's stack below it is recorded, while it is
+    suspended the chain of awaits it waits in (under "[await]") or "[yield]" if it waits for its
+    consumer, so CPU time and time waiting on the provider both show. Nothing else on the loop is
+    attributed to it. Stacks are counted in the collapsed format ("outer;inner count" per line)
+    read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, target, interval: float):
+        self.target = target
+        self.interval = interval
+        # ---
+        self.stacks = Counter()
+        self.seconds = 0.0
+        self._root = getattr(target, "cr_frame", None) or getattr(target, "ag_frame", None)
+        self._thread_id = threading.get_ident()  # started on the event loop thread
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def _sample(self):
+        frame = sys._current_frames().get(self._thread_id)
+        running = []
+        while frame is not None:
+            running.append(_label(frame.f_code))
+            if frame is self._root:
+                self.stacks[";".join(reversed(running))] += 1
+                return
+            frame = frame.f_back
+
+        if waiting := _await_chain(self.target):
+            at_yield = getattr(self.target, "ag_frame", None) is not None and self.target.ag_await is None
+            self.stacks[";".join(waiting[:1] + ["[yield]" if at_yield else "[await]"] + waiting[1:])] += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+            except Exception:  # frames changing while they are walked, the sample is skipped
+                pass
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.seconds = time.perf_counter() - self._started
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self) -> dict:
+        return dict(
+            request_id=logging.request_id_context.get(),
+            interval_ms=self.interval * 1000,
+            samples=sum(self.stacks.values()),
+            seconds=round(self.seconds, 3),
+            collapsed=self.collapsed(),
+        )
+
+
+def _write(profile: dict) -> str:
+    path = os.path.join(config.profile_dir, f"{profile['request_id']}.collapsed")
+    with open(path, "w") as f:
+        f.write(profile["collapsed"])
+    return path
+
+
+async def _finish(sampler: Sampler, mode: str) -> dict | None:
+    sampler.stop()
+    profile = sampler.summary()
+
+    if config.profile_dir:
+        try:
+            path = await run_in_threadpool(_write, profile)
+            logging.get_logger().info(f"Profile of {profile['samples']} samples written to {path}")
+        except OSError as e:
+            logging.get_logger().warning(f"Profile not written: {type(e).__name__}: {e}")
+
+    return profile if mode == RETURN else None
+
+
+# INIT
+
+if config.profile_sample_rate and not config.profile_dir:
+    raise ValueError("PROFILE_SAMPLE_RATE requires PROFILE_DIR to write the sampled profiles to")
+
+if config.profile_dir:
+    os.makedirs(config.profile_dir, exist_ok=True)
+
+
+# INTERFACE
+
+
+async def select(x_profile: str | None = Header(None)):
+    "Profile the request if an admin key asks for it with the x-profile header or if it is sampled."
+
+    if x_profile:
+        api_key = auth.api_key_context.get()
+        if not (api_key and api_key.admin):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Profiling requires an admin key")
+        profile_context.set(RETURN)
+
+    elif config.profile_sample_rate and random.random() < config.profile_sample_rate:
+        profile_context.set(WRITE)
+
+
+async def profile(call: Awaitable) -> dict:
+    "Await a chat call, sampling it if the request is profiled and adding the profile to its result for admins."
+
+    if not (mode := profile_context.get()):
+        return await call
+
+    sampler = Sampler(call, config.profile_interval)
+    sampler.start()
+    try:
+        result = await call
+    finally:
+        summary = await _finish(sampler, mode)
+
+    if summary:
+        result = {**result, "profile": summary}
+    return result
+
+
+def profile_events(events: AsyncGenerator) -> AsyncGenerator:
+    "The chat stream as is or, if the request is profiled, sampled like `profile` with the profile added to its success event."
+
+    if not (mode := profile_context.get()):
+        return events
+    return _profiled_events(events, mode)
+
+
+async def _profiled_events(events: AsyncGenerator, mode: str) -> AsyncGenerator:
+    sampler = Sampler(events, config.profile_interval)
+    sampler.start()
+    stopped = False
+    try:
+        async for event_type, event_data in events:
+            if event_type == "success":
+                stopped = True
+                if summary := await _finish(sampler, mode):
+                    event_data = {**event_data, "profile": summary}
+            yield event_type, event_data
+    finally:
+        if not stopped:
+            await _finish(sampler, mode)
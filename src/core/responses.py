@@ -0,0 +1,133 @@
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+import copy, json, sqlite3, threading, time
+
+from src.utils import caching
+import config
+
+
+# HELPER
+
+CONFIG_FLAG = "cache"  # langfuse prompt config key opting a prompt into response caching
+EXCLUDED_PARAMS = ("metadata", CONFIG_FLAG, "langfuse_public_key", "langfuse_secret_key", "langfuse_host")  # do not influence the completion
+
+
+def is_deterministic(params: dict) -> bool:
+    "Only greedy single choice sampling returns the same completion for the same params."
+
+    return params.get("temperature") == 0 and params.get("n", 1) == 1
+
+
+def _canonical(value):
+    if isinstance(value, type) and issubclass(value, BaseModel):
+        return value.model_json_schema()
+    return str(value)
+
+
+def key_for(params: dict, requested: bool | None) -> str | None:
+    """
+    Pop the prompt config's cache flag and return the cache key if caching applies.
+
+    The request's flag overrides the prompt config's and caching never applies to non-deterministic params.
+    """
+
+    enabled_by_prompt = params.pop(CONFIG_FLAG, False)
+    enabled = enabled_by_prompt if requested is None else requested
+
+    if not enabled or not response_cache or not is_deterministic(params):
+        return None
+
+    relevant = {k: v for k, v in params.items() if k not in EXCLUDED_PARAMS}
+    return caching.content_key(json.dumps(relevant, sort_keys=True, default=_canonical))
+
+
+class DiskCache:
+    """
+    Local key value tier surviving restarts and shared by workers on the same host.
+
+    Writes purge expired rows and the oldest ones over `max_rows` every PURGE_INTERVAL seconds,
+    so the file does not grow without bound.
+    """
+
+    PURGE_INTERVAL = 60
+
+    def __init__(self, path: str, ttl: float, max_rows: int):
+        self.ttl = ttl
+        self.max_rows = max_rows
+        # ---
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, stored_at REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at)")
+
+    def _purge(self, now: float):
+        self._db.execute("DELETE FROM responses WHERE stored_at <= ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM responses WHERE stored_at <= (SELECT stored_at FROM responses ORDER BY stored_at DESC LIMIT 1 OFFSET ?)",
+            (self.max_rows,),
+        )
+        self._last_purge = now
+
+    def _get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def _set(self, key, value, stored_at):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, json.dumps(value, default=str), stored_at))
+            if stored_at - self._last_purge > self.PURGE_INTERVAL:
+                self._purge(stored_at)
+
+    async def get(self, key):
+        return await run_in_threadpool(self._get, key)
+
+    async def set(self, key, value, stored_at):
+        await run_in_threadpool(self._set, key, value, stored_at)
+
+
+class ResponseCache:
+    """In-memory LRU of completions with an optional on-disk tier, entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float, path: str | None = None, max_rows: int = 100000):
+        self.ttl = ttl
+        self.memory = caching.LRUCache(maxsize)
+        self.disk = DiskCache(path, ttl, max_rows) if path else None
+        self.disk_hits = 0
+
+    def _is_fresh(self, stored_at: float) -> bool:
+        return time.time() - stored_at < self.ttl
+
+    async def get(self, key: str):
+        entry = self.memory.get(key)
+
+        if not entry and self.disk:
+            if entry := await self.disk.get(key):
+                self.disk_hits += 1
+                self.memory.set(key, entry)
+
+        if not entry or not self._is_fresh(entry[1]):
+            return None
+
+        # callers append the cached messages to their own histories
+        return copy.deepcopy(entry[0])
+
+    async def set(self, key: str, value):
+        entry = (value, time.time())
+        self.memory.set(key, entry)
+        if self.disk:
+            await self.disk.set(key, value, entry[1])
+
+    def stats(self) -> dict:
+        return dict(**self.memory.stats(), disk_hits=self.disk_hits)
+
+
+# INIT
+
+response_cache = (
+    ResponseCache(config.response_cache_size, config.response_cache_ttl, config.response_cache_path, config.response_cache_max_rows)
+    if config.response_cache_size > 0 or config.response_cache_path
+    else None
+)
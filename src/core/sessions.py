@@ -0,0 +1,160 @@
+from fastapi.concurrency import run_in_threadpool
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import hashlib, json, sqlite3, threading, time
+
+import config
+
+
+# HELPER
+
+
+class SessionHistoryMismatch(Exception):
+    "Raised if the client's history version does not match the stored session history."
+
+
+def advance_version(version: str | None, messages: list[dict]) -> str:
+    """
+    Chain a hash over appended messages so that a version only costs the new messages.
+
+    advance_version(advance_version(None, a), b) == advance_version(None, a + b)
+    """
+
+    digest = version or ""
+    for message in messages:
+        encoded = json.dumps(message, sort_keys=True, default=str)
+        digest = hashlib.sha256(f"{digest}{encoded}".encode()).hexdigest()
+    return digest
+
+
+class SessionStore(ABC):
+    """Interface for session history backends storing (version, messages) per session id."""
+
+    @abstractmethod
+    async def get(self, session_id: str) -> tuple[str, list[dict]] | None: ...
+
+    @abstractmethod
+    async def set(self, session_id: str, version: str, messages: list[dict]): ...
+
+
+class MemorySessionStore(SessionStore):
+    """Per-process LRU store whose entries expire after `ttl` seconds without use."""
+
+    def __init__(self, maxsize: int, ttl: float, **_):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # session_id -> (version, messages, touched_at)
+
+    async def get(self, session_id):
+        if not (entry := self._sessions.get(session_id)):
+            return None
+
+        version, messages, touched_at = entry
+        if time.monotonic() - touched_at > self.ttl:
+            del self._sessions[session_id]
+            return None
+
+        self._sessions.move_to_end(session_id)
+        return version, list(messages)
+
+    async def set(self, session_id, version, messages):
+        self._sessions[session_id] = (version, list(messages), time.monotonic())
+        self._sessions.move_to_end(session_id)
+
+        while len(self._sessions) > self.maxsize:
+            self._sessions.popitem(last=False)
+
+
+class SqliteSessionStore(SessionStore):
+    """Local persistent store surviving restarts and shared by workers on the same host."""
+
+    PURGE_INTERVAL = 300
+
+    def __init__(self, ttl: float, path: str, **_):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, version TEXT, messages TEXT, touched_at REAL)")
+
+    def _get(self, session_id):
+        with self._lock:
+            row = self._db.execute("SELECT version, messages, touched_at FROM sessions WHERE id = ?", (session_id,)).fetchone()
+
+        if not row or time.time() - row[2] > self.ttl:
+            return None
+        return row[0], json.loads(row[1])
+
+    def _set(self, session_id, version, messages):
+        now = time.time()
+        encoded = json.dumps(messages, default=str)
+
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)", (session_id, version, encoded, now))
+
+            if now - self._last_purge > self.PURGE_INTERVAL:
+                self._db.execute("DELETE FROM sessions WHERE touched_at < ?", (now - self.ttl,))
+                self._last_purge = now
+
+    async def get(self, session_id):
+        return await run_in_threadpool(self._get, session_id)
+
+    async def set(self, session_id, version, messages):
+        await run_in_threadpool(self._set, session_id, version, messages)
+
+
+BACKENDS: dict[str, type[SessionStore]] = dict(
+    memory=MemorySessionStore,
+    sqlite=SqliteSessionStore,
+)
+
+
+def create_store(backend: str | None, **options) -> SessionStore | None:
+    if not backend:
+        return None
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown session store '{backend}', expected one of: {', '.join(BACKENDS)}")
+
+    return BACKENDS[backend](**options)
+
+
+# INIT
+
+store = create_store(
+    config.session_store,
+    maxsize=config.session_store_size,
+    ttl=config.session_ttl,
+    path=config.session_store_path,
+)
+
+
+# INTERFACE
+
+
+async def load(session_id: str | None, history_version: str) -> tuple[str, list[dict]]:
+    "Return the stored history if the client's version matches it."
+
+    if not store:
+        raise SessionHistoryMismatch("Session store is disabled, full message history required")
+    if not session_id:
+        raise SessionHistoryMismatch("Session id required to continue from a history version")
+
+    stored = await store.get(session_id)
+    if not stored or stored[0] != history_version:
+        raise SessionHistoryMismatch("Unknown or outdated history version, full message history required")
+
+    return stored
+
+
+async def save(session_id: str | None, version: str | None, messages: list[dict], appended: list[dict]) -> str | None:
+    "Store the session history and return its new version."
+
+    if not store or not session_id:
+        return None
+
+    new_version = advance_version(version, appended)
+    await store.set(session_id, new_version, messages)
+    return new_version
@@ -1,11 +1,45 @@
 from sse_starlette.sse import EventSourceResponse
 from functools import wraps
 from typing import AsyncGenerator
-import json
+import inspect, time
+
+from src.core import metrics, codec
+from src.core.admission import ServiceOverloaded
+
+
+def error_data(e: Exception) -> dict:
+    "Error event data, counted per error type, also used for the per item errors of batches."
+
+    metrics.sse_error_events.inc(type(e).__name__)
+    return dict(type=type(e).__name__, message=str(e))
+
+
+def _error_event(e: Exception) -> tuple[str, dict]:
+    return "error", error_data(e)
+
+
+def _serialize(event_type: str, event_data) -> bytes:
+    "Encode the event straight to bytes as json has no raw line breaks and fits a single data line."
+
+    start_time = time.perf_counter()
+    event = b"event: " + event_type.encode() + b"\r\ndata: " + codec.dumps_bytes(event_data) + b"\r\n\r\n"
+    metrics.sse_serialize_seconds.observe(time.perf_counter() - start_time, event_type)
+    return event
 
 
 async def create_event(event_type: str, event_data) -> AsyncGenerator:
-    yield {"event": event_type, "data": json.dumps(event_data)}
+    yield _serialize(event_type, event_data)
+
+
+async def create_events(events: AsyncGenerator) -> AsyncGenerator:
+    "Forward (event_type, event_data) pairs as they are produced and end with an error event if one fails."
+
+    try:
+        async for event_type, event_data in events:
+            yield _serialize(event_type, event_data)
+
+    except Exception as e:
+        yield _serialize(*_error_event(e))
 
 
 def endpoint(func):
@@ -14,11 +48,23 @@ def endpoint(func):
         try:
             event_type, event_data = "success", await func(*args, **kwargs)
 
+            # endpoints returning a generator of events are streamed as is
+            if inspect.isasyncgen(event_data):
+                return EventSourceResponse(create_events(event_data))
+
             if not event_data:
                 raise ValueError("No event data received")
 
         except Exception as e:
-            event_type, event_data = "error", dict(type=type(e).__name__, message=str(e))
+            event_type, event_data = _error_event(e)
+            # shed requests carry their status so clients back off before parsing events, other
+            # errors (including provider errors with a status code) are only sent as the error event
+            if isinstance(e, ServiceOverloaded):
+                return EventSourceResponse(
+                    create_event(event_type, event_data),
+                    status_code=e.status_code,
+                    headers={"Retry-After": str(e.retry_after)},
+                )
 
         response = EventSourceResponse(create_event(event_type, event_data))
         return response
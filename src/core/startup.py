@@ -0,0 +1,103 @@
+from fastapi import FastAPI, Depends
+import asyncio, time
+
+from src.core import logging
+from src.services import litellm, langfuse
+import config
+
+
+# HELPER
+
+MODES = ("warmup", "lazy", "eager")
+WARMUP_DELAY = 1.0  # seconds for the server to start listening before warming up
+
+_loading = None  # task running preload in a thread, awaited by everything that needs it
+loaded = False
+
+
+def preload() -> float:
+    "Import and configure the llm and tracing libraries and build the langfuse clients, returns the seconds it took."
+
+    start_time = time.perf_counter()
+    litellm.provider()
+    langfuse.ClientManager.load()
+    return time.perf_counter() - start_time
+
+
+async def _load():
+    global loaded, _loading
+
+    try:
+        # in a thread so the loop keeps serving health checks and other requests meanwhile
+        seconds = await asyncio.to_thread(preload)
+    except Exception:
+        _loading = None  # retried by the next request
+        raise
+
+    loaded = True
+    logging.get_logger().info(f"Imports finished in {seconds:.2f}s")
+
+
+async def _warm_up():
+    await asyncio.sleep(WARMUP_DELAY)
+    try:
+        await load()
+    except Exception as e:
+        logging.get_logger().error(f"Warm-up failed: {type(e).__name__}: {e}")
+
+
+# INIT
+
+mode = config.startup_mode
+
+
+def setup(app: FastAPI, startup_mode: str = config.startup_mode):
+    """
+    "eager" imports everything before the app starts, "lazy" on first use and "warmup" on first use
+    or in a task shortly after the app started listening, so the port opens without waiting for it.
+    Both import in a thread, requests needing the imports wait for them without blocking the loop.
+    """
+
+    global mode, loaded
+
+    if startup_mode not in MODES:
+        raise ValueError(f"Unknown startup mode '{startup_mode}', expected one of: {', '.join(MODES)}")
+    mode = startup_mode
+
+    if mode == "eager":
+        preload()
+        loaded = True
+
+    elif mode == "warmup":
+        tasks = set()
+
+        def start():
+            task = asyncio.create_task(_warm_up())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        app.add_event_handler("startup", start)
+
+
+# INTERFACE
+
+
+async def load():
+    "Wait until litellm and langfuse are imported, starting the import if nothing did yet."
+
+    global _loading
+
+    if loaded:
+        return
+    if _loading is None:
+        _loading = asyncio.ensure_future(_load())
+    await asyncio.shield(_loading)
+
+
+def ready() -> bool:
+    "Whether requests are served without waiting for imports, lazy mode always accepts them and imports on demand."
+
+    return loaded or mode == "lazy"
+
+
+via_loaded = Depends(load)
@@ -0,0 +1,57 @@
+from fastapi import WebSocket, WebSocketDisconnect
+from typing import AsyncGenerator, Callable
+import time, uuid
+
+from src.core import logging, metrics, codec, sse
+from src.security import limits
+
+
+async def _send(websocket: WebSocket, event_type: str, event_data):
+    await websocket.send_text(codec.dumps(dict(event=event_type, data=event_data)))
+
+
+async def serve(websocket: WebSocket, handle: Callable[[dict], AsyncGenerator]):
+    """
+    Accept the connection and answer each json frame with the (event_type, event_data) pairs its
+    handler yields as `{"event": ..., "data": ...}` frames, the same events SSE endpoints send.
+
+    Frames are handled one after the other. Each frame after the first is charged against the rate
+    limits like a request, the first was with the handshake. A failing or limited frame sends an
+    error event and the connection stays open for the next one.
+    """
+
+    logger = logging.get_logger()
+    await websocket.accept()
+
+    frames = 0
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+            # every frame is logged and timed like a request of its own
+            logging.request_id_context.set(str(uuid.uuid4()))
+            start_time = time.perf_counter()
+            try:
+                if frames:
+                    await limits.charge()
+                frames += 1
+                frame = codec.loads(message.get("text") or message.get("bytes") or b"")
+                async for event_type, event_data in handle(frame):
+                    await _send(websocket, event_type, event_data)
+                result = "success"
+
+            except WebSocketDisconnect:
+                raise
+
+            except Exception as e:
+                result = "error"
+                await _send(websocket, "error", sse.error_data(e))
+
+            metrics.websocket_turns.inc(result)
+            log_method = logger.info if result == "success" else logger.warning
+            log_method(f"Turn {result}", extra=dict(endpoint=websocket.url.path, ms=round((time.perf_counter() - start_time) * 1000)))
+
+    except WebSocketDisconnect:
+        pass
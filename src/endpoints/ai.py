@@ -1,15 +1,31 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, WebSocket
 
 from src.security import auth
-from src.core import sse
+from src.core import sse, ws, codec, profiling, startup
 
-from src.chat import ChatRequest, call
+from src.chat import ChatRequest, BatchRequest, ChatTurn, ChatSession, call, stream, batch
 
 
-router = APIRouter(prefix="/ai")
+router = APIRouter(prefix="/ai", route_class=codec.CodecRoute, dependencies=[startup.via_loaded])
 
 
-@router.post("/chat")
+@router.post("/chat", dependencies=[Depends(profiling.select)])
 @sse.endpoint
 async def chat(request: ChatRequest):
-    return await call(request)
+    if request.stream:
+        return profiling.profile_events(stream(request))
+    return await profiling.profile(call(request))
+
+
+@router.post("/batch")
+@sse.endpoint
+async def chat_batch(request: BatchRequest):
+    return batch(request)
+
+
+@router.websocket("/ws")
+async def chat_ws(websocket: WebSocket):
+    "Chat turns over one connection keeping the session state in between, see ChatTurn."
+
+    session = ChatSession()
+    await ws.serve(websocket, lambda frame: session.turn(ChatTurn.model_validate(frame)))
@@ -0,0 +1,21 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from src.core import metrics
+from src.endpoints import stats
+
+
+router = APIRouter()
+
+
+def _cache_stats() -> dict:
+    return {(cache, stat): value for cache, cache_stats in stats.cache_stats().items() for stat, value in cache_stats.items()}
+
+
+metrics.CallbackGauge("overlord_cache", "Cache sizes, hit and miss counts and latencies by cache.", ("cache", "stat"), _cache_stats)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus():
+    # rendered on the event loop as the metrics are updated there without locks
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,25 @@
+from fastapi import APIRouter
+
+from src.services import langfuse, attachments
+from src.core import responses, compaction
+from src import chat
+
+
+router = APIRouter(prefix="/stats")
+
+
+def cache_stats() -> dict:
+    return dict(
+        schemas=chat.schema_cache.stats(),
+        prompts=langfuse.prompt_cache.stats(),
+        token_counts=compaction.token_cache.stats(),
+        summaries=compaction.summary_cache.stats(),
+        **(dict(responses=responses.response_cache.stats()) if responses.response_cache else {}),
+        **(dict(attachments=attachments.pipeline.stats()) if attachments.pipeline else {}),
+    )
+
+
+@router.get("/caches")
+async def caches():
+    # read on the event loop like the metrics, as the caches are updated there
+    return cache_stats()
@@ -2,20 +2,108 @@ import config
 
 from fastapi import Security, HTTPException, status
 from fastapi.security import APIKeyHeader
+from starlette.requests import HTTPConnection
+from contextvars import ContextVar
+from typing import NamedTuple
+import hashlib
 
+from src.core import metrics
+from src.security.usage import tracker
 
-api_key_header = APIKeyHeader(name="x-api-key")
 
+# HELPER
 
-def validate_api_key(api_key_header: str = Security(api_key_header)):
-    if api_key_header not in config.access_keys:
+
+class ApiKey(NamedTuple):
+    id: str  # name used for limits, metrics and logs instead of the key itself
+    tier: str
+    quota: int | None  # tokens per quota period, unlimited if None
+    admin: bool = False  # may request profiles of its requests
+
+
+api_key_context = ContextVar("api_key", default=None)
+
+
+class ConnectionAPIKeyHeader(APIKeyHeader):
+    "APIKeyHeader that also resolves for websocket routes, which have no Request to inject."
+
+    async def __call__(self, request: HTTPConnection) -> str | None:
+        return self.check_api_key(request.headers.get(self.model.name), self.auto_error)
+
+
+def hash_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def _load_keys(access_keys: list | dict) -> dict[str, ApiKey]:
+    """
+    Map key hashes to their settings so plaintext keys are not kept and lookups are a single dict access.
+
+    Accepts a list of keys (default tier, no quota) or a dict of key -> settings with optional
+    "tier", "quota", "name" and "admin". Keys given as "sha256:<hex digest>" are used as hashes directly.
+    """
+
+    if isinstance(access_keys, list):
+        access_keys = {key: {} for key in access_keys}
+
+    keys = {}
+
+    for key, settings in access_keys.items():
+        key_hash = key.removeprefix("sha256:") if key.startswith("sha256:") else hash_key(key)
+        tier = settings.get("tier", "default")
+
+        if tier not in config.rates:
+            raise ValueError(f"Unknown tier '{tier}' for access key, expected one of {list(config.rates)}")
+
+        keys[key_hash] = ApiKey(settings.get("name", key_hash[:12]), tier, settings.get("quota"), bool(settings.get("admin")))
+
+    return keys
+
+
+# INIT
+
+keys = _load_keys(config.access_keys)
+api_key_header = ConnectionAPIKeyHeader(name="x-api-key")
+
+
+# INTERFACE
+
+
+def lookup(api_key: str | None) -> ApiKey | None:
+    return keys.get(hash_key(api_key)) if api_key else None
+
+
+async def validate_api_key(api_key_header: str = Security(api_key_header)):
+    if not (api_key := lookup(api_key_header)):
+        metrics.auth_failures.inc()
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid API Key",
             headers={"WWW-Authenticate": "APIKey"},
         )
 
+    check_quota(api_key)
+
+    api_key_context.set(api_key)
+    tracker.record(api_key.id, requests=1)
+
     return api_key_header
 
 
+def check_quota(api_key: ApiKey):
+    if api_key.quota is not None and tracker.tokens_used(api_key.id) >= api_key.quota:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Token quota exceeded",
+            headers={"Retry-After": str(tracker.period_reset())},
+        )
+
+
+def record_tokens(tokens: int):
+    "Add tokens to the quota and usage of the current request's API key."
+
+    if tokens and (api_key := api_key_context.get()):
+        tracker.record(api_key.id, tokens=tokens)
+
+
 via_api_key = Security(validate_api_key)
@@ -0,0 +1,178 @@
+from fastapi.concurrency import run_in_threadpool
+from abc import ABC, abstractmethod
+from urllib.parse import urlparse
+import asyncio, sqlite3, threading, time
+
+
+class CounterBackend(ABC):
+    """Interface for counter stores shared by all workers and replicas."""
+
+    @abstractmethod
+    async def sync(self, increments: dict[str, tuple[int, int]], keys: list[str]) -> dict[str, int]:
+        """
+        Atomically add increments given as key -> (amount, ttl seconds) and
+        return the current totals of the requested keys (missing keys are 0).
+        """
+
+
+class SqliteCounterBackend(CounterBackend):
+    """Shares counters between workers on the same host through a local database file."""
+
+    PURGE_INTERVAL = 60
+    MAX_VARIABLES = 500
+
+    def __init__(self, path: str, timeout: float = 5):
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+        self._db = sqlite3.connect(path or "rate_limits.sqlite3", check_same_thread=False, isolation_level=None, timeout=timeout)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER, expires REAL)")
+
+    def _sync(self, increments, keys):
+        now = time.time()
+        totals = {}
+
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(
+                    "INSERT INTO counters VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE SET value = value + excluded.value, expires = excluded.expires",
+                    [(key, amount, now + ttl) for key, (amount, ttl) in increments.items()],
+                )
+
+                for start in range(0, len(keys), self.MAX_VARIABLES):
+                    chunk = keys[start : start + self.MAX_VARIABLES]
+                    rows = self._db.execute(
+                        f"SELECT key, value FROM counters WHERE expires > ? AND key IN ({', '.join('?' * len(chunk))})",
+                        (now, *chunk),
+                    )
+                    totals.update(rows)
+
+                if now - self._last_purge > self.PURGE_INTERVAL:
+                    self._db.execute("DELETE FROM counters WHERE expires <= ?", (now,))
+                    self._last_purge = now
+
+                self._db.execute("COMMIT")
+            except:
+                self._db.execute("ROLLBACK")
+                raise
+
+        return totals
+
+    async def sync(self, increments, keys):
+        return await run_in_threadpool(self._sync, increments, keys)
+
+
+class RedisCounterBackend(CounterBackend):
+    """
+    Shares counters across hosts through any server speaking the Redis protocol (RESP).
+
+    Commands of one sync are pipelined over a single persistent connection. Connecting and each
+    round trip give up after `timeout` seconds and drop the connection, so a hung server fails
+    the sync instead of stalling it, and the next sync reconnects.
+    """
+
+    def __init__(self, url: str, timeout: float = 0.5):
+        parsed = urlparse(url or "redis://localhost:6379/0")
+        self._host = parsed.hostname or "localhost"
+        self._port = parsed.port or 6379
+        self._password = parsed.password
+        self._db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        # ---
+        self._lock = asyncio.Lock()
+        self._reader = None
+        self._writer = None
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+
+        kind, payload = line[:1], line[1:-2]
+
+        if kind in (b"+", b":"):
+            return int(payload) if kind == b":" else payload.decode()
+        if kind == b"-":
+            raise RuntimeError(f"Redis error: {payload.decode()}")
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            return [await self._read_reply() for _ in range(int(payload))]
+
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    async def _round_trip(self, commands: list[tuple]) -> list:
+        self._writer.write(b"".join(self._encode(*command) for command in commands))
+        await self._writer.drain()
+        return [await self._read_reply() for _ in commands]
+
+    async def _execute(self, commands: list[tuple]) -> list:
+        return await asyncio.wait_for(self._round_trip(commands), self.timeout)
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self._host, self._port), self.timeout)
+
+        setup_commands = []
+        if self._password:
+            setup_commands.append(("AUTH", self._password))
+        if self._db:
+            setup_commands.append(("SELECT", self._db))
+        if setup_commands:
+            await self._execute(setup_commands)
+
+    def _close(self):
+        if self._writer:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def sync(self, increments, keys):
+        commands = []
+        for key, (amount, ttl) in increments.items():
+            commands += [("INCRBY", key, amount), ("EXPIRE", key, ttl)]
+        if keys:
+            commands.append(("MGET", *keys))
+
+        if not commands:
+            return {}
+
+        async with self._lock:
+            try:
+                if not self._writer:
+                    await self._connect()
+                replies = await self._execute(commands)
+            except:
+                self._close()  # reconnect on next sync instead of reading a half consumed reply
+                raise
+
+        values = replies[-1] if keys else []
+        return {key: int(value) for key, value in zip(keys, values) if value is not None}
+
+
+BACKENDS: dict[str, type[CounterBackend]] = dict(
+    sqlite=SqliteCounterBackend,
+    redis=RedisCounterBackend,
+)
+
+
+def create_backend(backend: str | None, url: str | None, timeout: float = 0.5) -> CounterBackend | None:
+    if not backend:
+        return None
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown rate limit backend '{backend}', expected one of: {', '.join(BACKENDS)}")
+
+    return BACKENDS[backend](url, timeout)
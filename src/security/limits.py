@@ -1,11 +1,51 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
-import time
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from contextvars import ContextVar
+from typing import NamedTuple
+import asyncio, math, time
+
+from src.core import logging, metrics
+from src.security.limit_backends import CounterBackend, create_backend
+
+
+class RateLimitStatus(NamedTuple):
+    """Outcome of a rate limit check for the most restrictive limit."""
+
+    exceeded: str | None
+    limit: int
+    remaining: int
+    reset: int
+    retry_after: int | None = None
+
+    def headers(self) -> dict[str, str]:
+        headers = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(self.reset),
+        }
+        if self.retry_after is not None:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+class RateLimitExceeded(Exception):
+    "Raised for work charged within a request (websocket turns, batch items) over the rate limit, sent as an error event."
+
+    def __init__(self, status: RateLimitStatus):
+        super().__init__(f"Rate limit exceeded: {status.exceeded}, retry after {status.retry_after} seconds")
+        self.retry_after = status.retry_after
+
+
+client_context = ContextVar("rate_limit_client", default=None)  # (limiter, client id, client type) of the request or websocket
 
 
 class RateLimiter:
-    """Rate limiter with different limits per client type."""
+    """
+    Rate limiter with different limits per client type.
+
+    Uses sliding window counters: per limit only the previous and current window's counts are kept,
+    the previous one weighted by how much of it still overlaps the sliding window. Memory per client
+    is constant and clients idle for longer than the largest window are evicted.
+    """
 
     TIME_UNITS = dict(
         second=1,
@@ -16,7 +56,9 @@ class RateLimiter:
 
     def __init__(self, rate_configs: dict[str, list[str]]):
         self.configs = self._parse_configs(rate_configs)
-        self.history = defaultdict(list)
+        self.max_window = max((window for limits in self.configs.values() for _, window, _ in limits), default=0)
+        # key -> [last_seen, window_index, previous_count, current_count, ...repeated per limit]
+        self.history = OrderedDict()
 
     def _parse_configs(self, rate_configs: dict) -> dict:
         """Validate and pre-parse rate limit strings."""
@@ -42,41 +84,218 @@ class RateLimiter:
 
         return parsed
 
-    def check_request(self, ip: str, client_type: str) -> str | None:
-        """Check if request should be rate limited. Returns limit string if exceeded."""
+    def _evict_idle(self, now: float):
+        """Drop clients that have not been seen for longer than the largest window."""
+
+        cutoff = now - self.max_window
+        while self.history:
+            oldest_key = next(iter(self.history))
+            if self.history[oldest_key][0] > cutoff:
+                break
+            del self.history[oldest_key]
+
+    @staticmethod
+    def _retry_after(max_requests: int, window: int, previous: int, current: int, elapsed: float, cost: int = 1) -> float:
+        """Seconds until `cost` more requests fit into the sliding window."""
+
+        allowed = max(0, max_requests - cost)
+
+        if current > allowed:
+            # wait for the next window where the current count becomes the weighted previous one
+            return (window - elapsed) + window * (max(0.0, 1 - allowed / current) if current else 1.0)
+
+        if not previous:
+            # more than the limit at once, nothing waits for longer than the current window
+            return window - elapsed
+
+        return max(0.0, window * (1 - (allowed - current) / previous) - elapsed)
+
+    @classmethod
+    def _assess(cls, now: float, windows: list[tuple[int, int, str, int, int]], cost: int = 1) -> RateLimitStatus:
+        """Evaluate (max_requests, window, limit_str, previous_count, current_count) per limit for `cost` more requests."""
+
+        tightest = None
+
+        for max_requests, window, limit_str, previous, current in windows:
+            elapsed = now % window
+            estimate = previous * (1 - elapsed / window) + current
+
+            if estimate + cost > max_requests:
+                retry_after = math.ceil(cls._retry_after(max_requests, window, previous, current, elapsed, cost))
+                return RateLimitStatus(limit_str, max_requests, 0, retry_after, retry_after)
+
+            remaining = math.floor(max_requests - estimate - cost)
+            if tightest is None or remaining < tightest[1]:
+                tightest = (max_requests, remaining, math.ceil(window - elapsed))
+
+        return RateLimitStatus(None, *tightest)
+
+    def _limits(self, client_type: str) -> list[tuple[int, int, str]]:
+        return self.configs.get(client_type, self.configs.get("default", []))
+
+    def check_request(self, client_id: str, client_type: str, cost: int = 1) -> RateLimitStatus | None:
+        """
+        Check and record a request against all limits of the client type. Status holds the exceeded limit string if any.
+
+        `cost` counts the request as that many, like a batch of requests.
+        """
 
-        limits = self.configs.get(client_type, self.configs.get("default", []))
+        limits = self._limits(client_type)
+        if not limits:
+            return None
+
+        now = time.monotonic()
+        self._evict_idle(now)
+
+        key = f"{client_type}:{client_id}"
+        state = self.history.pop(key, None) or [now] + [0, 0, 0] * len(limits)
+        state[0] = now
+        self.history[key] = state  # re-insert as most recently seen
+
+        windows = []
+        for position, (max_requests, window, limit_str) in enumerate(limits):
+            offset = 1 + position * 3
+            window_index, previous, current = state[offset : offset + 3]
+
+            # roll counters forward into the current window
+            now_index = now // window
+            if window_index != now_index:
+                previous = current if window_index == now_index - 1 else 0
+                current = 0
+                state[offset : offset + 3] = now_index, previous, current
+
+            windows.append((max_requests, window, limit_str, previous, current))
+
+        status = self._assess(now, windows, cost)
+
+        # record only once all limits allow the request
+        if not status.exceeded:
+            for position in range(len(limits)):
+                state[1 + position * 3 + 2] += cost
+
+        return status
+
+    async def check(self, client_id: str, client_type: str, cost: int = 1) -> RateLimitStatus | None:
+        return self.check_request(client_id, client_type, cost)
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    Rate limiter whose counters live in a backend shared by all workers and replicas.
+
+    Requests are checked against the last known shared counts plus this worker's own unsynced
+    requests. Every `sync_interval` seconds the local increments are flushed and the counts of
+    recently seen clients refreshed in a single batch, so the shared store is not hit per request.
+    Other workers' requests are therefore seen with a delay of up to one interval.
+
+    Syncs run one at a time in a background task, so checks never wait on the network. While the
+    backend is unavailable requests are limited by this worker's own counts, which are flushed
+    once a sync succeeds again.
+    """
+
+    def __init__(self, rate_configs: dict[str, list[str]], backend: CounterBackend, sync_interval: float):
+        super().__init__(rate_configs)
+        self.backend = backend
+        self.sync_interval = sync_interval
+        # ---
+        self._shared = {}  # counter key -> shared total as of the last sync
+        self._pending = defaultdict(int)  # counter key -> requests not yet flushed
+        self._flushing = {}  # counter key -> requests being flushed by the running sync
+        self._ttls = {}  # counter key -> expiry to set when flushing
+        self._active = set()  # counter keys used since the last sync
+        self._last_sync = 0.0
+        self._sync_task = None
+        self.available = True
+        self.sync_errors = 0
+
+    async def _sync(self):
+        pending, self._pending = self._pending, defaultdict(int)
+        self._flushing = pending
+        ttls, self._ttls = self._ttls, {}
+        active, self._active = self._active, set()
+
+        try:
+            increments = {key: (amount, ttls[key]) for key, amount in pending.items()}
+            self._shared = await self.backend.sync(increments, list(active | pending.keys()))
+
+        except Exception as e:
+            # limit by this worker's counts only until a sync succeeds and retry flushing them with the next one
+            self.sync_errors += 1
+            self._shared = {}
+            for key, amount in pending.items():
+                self._pending[key] += amount
+                self._ttls.setdefault(key, ttls[key])
+            self._active |= active
+
+            if self.available:
+                self.available = False
+                logging.get_logger().warning(f"Rate limit backend unavailable, limiting per worker: {type(e).__name__}: {e}")
+
+        else:
+            if not self.available:
+                self.available = True
+                logging.get_logger().info("Rate limit backend available again")
+
+        finally:
+            self._flushing = {}
+            self._last_sync = time.time()
+            self._sync_task = None
+
+    async def check(self, client_id: str, client_type: str, cost: int = 1) -> RateLimitStatus | None:
+        limits = self._limits(client_type)
+        if not limits:
+            return None
+
+        # wall clock as windows must line up across hosts
         now = time.time()
+        if self._sync_task is None and now - self._last_sync >= self.sync_interval:
+            self._sync_task = asyncio.create_task(self._sync())
 
+        windows, current_keys = [], []
         for max_requests, window, limit_str in limits:
-            key = f"{client_type}:{ip}:{limit_str}"
+            window_index = int(now // window)
+            previous_key = f"rl:{client_type}:{client_id}:{limit_str}:{window_index - 1}"
+            current_key = f"rl:{client_type}:{client_id}:{limit_str}:{window_index}"
+
+            self._active.update((previous_key, current_key))
+            self._ttls.setdefault(current_key, window * 2)
+            current_keys.append(current_key)
+
+            previous = self._shared.get(previous_key, 0) + self._flushing.get(previous_key, 0) + self._pending.get(previous_key, 0)
+            current = self._shared.get(current_key, 0) + self._flushing.get(current_key, 0) + self._pending.get(current_key, 0)
+            windows.append((max_requests, window, limit_str, previous, current))
+
+        status = self._assess(now, windows, cost)
 
-            # Clean old timestamps
-            cutoff = now - window
-            self.history[key] = [t for t in self.history[key] if t > cutoff]
+        if not status.exceeded:
+            for current_key in current_keys:
+                self._pending[current_key] += cost
 
-            # Check limit
-            if len(self.history[key]) >= max_requests:
-                return limit_str
+        return status
 
-            # Record request
-            self.history[key].append(now)
 
-            # Prevent memory growth
-            if len(self.history[key]) > max_requests * 2:
-                self.history[key] = self.history[key][-max_requests:]
+def setup(
+    rate_configs: dict[str, list[str]],
+    backend: str | None = None,
+    backend_url: str | None = None,
+    sync_interval: float = 0.25,
+    backend_timeout: float = 0.5,
+) -> RateLimiter:
+    """Create the rate limiter with counters shared through a backend if one is set."""
 
+    if counter_backend := create_backend(backend, backend_url, backend_timeout):
+        return SharedRateLimiter(rate_configs, counter_backend, sync_interval)
+    return RateLimiter(rate_configs)
 
-def setup(app: FastAPI, rate_configs: dict[str, list[str]]):
-    """Setup rate limiting middleware."""
-    limiter = RateLimiter(rate_configs)
 
-    @app.middleware("http")
-    async def rate_limit_middleware(request: Request, call_next):
-        ip = request.client.host or "unknown"
-        client_type = request.headers.get("x-client-type", "default")
+async def charge(cost: int = 1):
+    "Charge work within a request, like a websocket turn or the items of a batch, against the client's rate limits."
 
-        if exceeded_limit := limiter.check_request(ip, client_type):
-            return JSONResponse(status_code=429, content={"detail": f"Rate limit exceeded: {exceeded_limit}"})
+    if cost <= 0 or not (client := client_context.get()):
+        return
 
-        return await call_next(request)
+    limiter, client_id, client_type = client
+    status = await limiter.check(client_id, client_type, cost)
+    if status and status.exceeded:
+        metrics.rate_limit_rejections.inc(client_type, status.exceeded)
+        raise RateLimitExceeded(status)
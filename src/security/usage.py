@@ -0,0 +1,72 @@
+from collections import defaultdict
+from fastapi import FastAPI
+import math, time
+
+from src.core import logging, metrics
+import config
+
+
+class KeyUsage:
+    """
+    In-memory request and token counters per API key.
+
+    Increments are plain dict operations on the request path. They are flushed to the logs and
+    metrics at most every `flush_interval` seconds (checked when usage is recorded) and on shutdown.
+    Token totals per `quota_period` are kept for quota checks and are per worker.
+    """
+
+    def __init__(self, flush_interval: float, quota_period: float):
+        self.flush_interval = flush_interval
+        self.quota_period = quota_period
+        # ---
+        self._pending = defaultdict(lambda: [0, 0])  # key id -> [requests, tokens] since the last flush
+        self._period = None
+        self._period_tokens = defaultdict(int)  # key id -> tokens used in the current quota period
+        self._last_flush = time.monotonic()
+
+    def _roll_period(self):
+        period = int(time.time() // self.quota_period)
+        if period != self._period:
+            self._period = period
+            self._period_tokens.clear()
+
+    def record(self, key_id: str, requests: int = 0, tokens: int = 0):
+        self._roll_period()
+        counters = self._pending[key_id]
+        counters[0] += requests
+        counters[1] += tokens
+        self._period_tokens[key_id] += tokens
+
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def period_reset(self) -> int:
+        "Seconds until the current quota period ends."
+
+        return math.ceil(self.quota_period - time.time() % self.quota_period)
+
+    def tokens_used(self, key_id: str) -> int:
+        self._roll_period()
+        return self._period_tokens.get(key_id, 0)
+
+    def flush(self):
+        pending, self._pending = self._pending, defaultdict(lambda: [0, 0])
+        self._last_flush = time.monotonic()
+        if not pending:
+            return
+
+        for key_id, (requests, tokens) in pending.items():
+            metrics.key_requests.inc(key_id, amount=requests)
+            metrics.key_tokens.inc(key_id, amount=tokens)
+
+        usage = {key_id: dict(requests=requests, tokens=tokens) for key_id, (requests, tokens) in pending.items()}
+        logging.get_logger().info("Key usage", extra=dict(usage=usage))
+
+
+# INIT
+
+tracker = KeyUsage(config.key_usage_flush_interval, config.key_quota_period)
+
+
+def setup(app: FastAPI):
+    app.add_event_handler("shutdown", tracker.flush)
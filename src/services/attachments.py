@@ -0,0 +1,231 @@
+from fastapi import FastAPI
+import asyncio, base64, io, ipaddress, httpx, socket
+
+from src.utils import caching
+from src.core import logging
+import config
+
+try:
+    from PIL import Image
+except ImportError:  # inlining is skipped without pillow as full size images would bloat requests
+    Image = None
+
+
+# HELPER
+
+PASS_ON = ""  # cached for urls that would not be inlined on a retry either (not an image, too large or blocked)
+MAX_REDIRECTS = 5
+
+
+class AttachmentTooLarge(ValueError):
+    "Raised if an attachment exceeds the configured size limit."
+
+
+class AttachmentBlocked(ValueError):
+    "Raised if an attachment url points to a loopback, link-local, private or otherwise non public address."
+
+
+async def _check_address(url: httpx.URL):
+    "Resolve the url's host and reject it unless all its addresses are public, so clients cannot reach internal services."
+
+    try:
+        addresses = [ipaddress.ip_address(url.host)]
+    except ValueError:
+        port = url.port or (443 if url.scheme == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(url.host, port, type=socket.SOCK_STREAM)
+        addresses = [ipaddress.ip_address(info[4][0]) for info in infos]
+
+    for address in addresses:
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global:
+            raise AttachmentBlocked(f"Attachment host {url.host} resolves to a non public address")
+
+
+class AttachmentPipeline:
+    """
+    Downloads image attachments, downscales them and inlines them as base64 data urls.
+
+    Downloads run concurrently through one pooled client with a size limit per file. Processed
+    images are cached by content hash and urls map to their content hash, so repeated urls in a
+    session are neither fetched nor processed again. Concurrent requests for the same url share one
+    download. Redirects are followed by hand so every hop's host is checked to resolve to public
+    addresses only. Attachments that cannot be fetched, are too large, are not images or point to
+    internal addresses are passed on as urls.
+    """
+
+    def __init__(self, max_bytes: int, max_edge: int, quality: int, timeout: float, max_connections: int, cache_size: int):
+        self.max_bytes = max_bytes
+        self.max_edge = max_edge
+        self.quality = quality
+        self.timeout = timeout
+        self.max_connections = max_connections
+        # ---
+        self.urls = caching.LRUCache(cache_size)  # url -> content key
+        self.images = caching.LRUCache(cache_size)  # content key -> data url
+        self._inflight = {}  # url -> task resolving to a data url or None
+        self._client = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _download(self, url: str) -> tuple[bytes, str]:
+        request_url = httpx.URL(url)
+
+        for _ in range(MAX_REDIRECTS + 1):
+            await _check_address(request_url)
+
+            async with self._get_client().stream("GET", request_url) as response:
+                if response.is_redirect:
+                    request_url = request_url.join(response.headers["location"])
+                    continue
+                response.raise_for_status()
+
+                if int(response.headers.get("content-length") or 0) > self.max_bytes:
+                    raise AttachmentTooLarge(f"Attachment exceeds {self.max_bytes} bytes: {url}")
+
+                chunks, size = [], 0
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise AttachmentTooLarge(f"Attachment exceeds {self.max_bytes} bytes: {url}")
+                    chunks.append(chunk)
+
+                content_type = response.headers.get("content-type", "").split(";")[0].strip()
+                return b"".join(chunks), content_type
+
+        raise ValueError(f"Attachment redirected more than {MAX_REDIRECTS} times: {url}")
+
+    def _downscale(self, content: bytes, content_type: str) -> tuple[bytes, str]:
+        "Fit the image into max_edge and re-encode it, keeping the original if that is not smaller."
+
+        with Image.open(io.BytesIO(content)) as image:
+            image.thumbnail((self.max_edge, self.max_edge))
+
+            output = io.BytesIO()
+            if image.mode in ("RGBA", "LA", "P"):
+                image.save(output, format="PNG", optimize=True)
+                encoded, encoded_type = output.getvalue(), "image/png"
+            else:
+                image.convert("RGB").save(output, format="JPEG", quality=self.quality, optimize=True)
+                encoded, encoded_type = output.getvalue(), "image/jpeg"
+
+        if len(encoded) >= len(content) and content_type.startswith("image/"):
+            return content, content_type
+        return encoded, encoded_type
+
+    async def _inline(self, url: str) -> str | None:
+        try:
+            content, content_type = await self._download(url)
+        except (AttachmentTooLarge, AttachmentBlocked):
+            self.urls.set(url, PASS_ON)
+            raise
+
+        if not content_type.startswith("image/"):
+            self.urls.set(url, PASS_ON)
+            return None
+
+        content_key = caching.content_key(content)
+        if (data_url := self.images.get(content_key)) is None:
+            # decoding and encoding is cpu bound
+            content, content_type = await asyncio.to_thread(self._downscale, content, content_type)
+            data_url = f"data:{content_type};base64,{base64.b64encode(content).decode()}"
+            self.images.set(content_key, data_url)
+
+        self.urls.set(url, content_key)
+        return data_url
+
+    async def _inline_once(self, url: str) -> str | None:
+        if (content_key := self.urls.get(url)) == PASS_ON:
+            return None
+        if content_key is not None and (data_url := self.images.get(content_key)) is not None:
+            return data_url
+
+        if url not in self._inflight:
+            self._inflight[url] = asyncio.ensure_future(self._inline(url))
+            self._inflight[url].add_done_callback(lambda _: self._inflight.pop(url, None))
+
+        try:
+            return await asyncio.shield(self._inflight[url])
+        except Exception as e:
+            logging.get_logger().warning(f"Attachment passed on as url: {type(e).__name__}: {e}")
+            return None
+
+    async def inline(self, messages: list[dict]) -> list[dict]:
+        "Returns messages with http(s) image urls replaced by data urls, leaving the given messages untouched."
+
+        urls = {url for message in messages for url in _image_urls(message)}
+        if not urls:
+            return messages
+
+        results = await asyncio.gather(*(self._inline_once(url) for url in urls))
+        data_urls = {url: data_url for url, data_url in zip(urls, results) if data_url}
+
+        return [_replace_image_urls(message, data_urls) for message in messages]
+
+    def stats(self) -> dict:
+        return dict(**self.images.stats(), url_hits=self.urls.hits, url_misses=self.urls.misses)
+
+
+def _part_url(part: dict) -> str | None:
+    image_url = part.get("image_url")
+    return image_url.get("url") if isinstance(image_url, dict) else image_url
+
+
+def _image_urls(message: dict):
+    if not isinstance(message.get("content"), list):
+        return
+
+    for part in message["content"]:
+        if isinstance(part, dict) and part.get("type") == "image_url":
+            url = _part_url(part)
+            if isinstance(url, str) and url.startswith(("http://", "https://")):
+                yield url
+
+
+def _replace_image_urls(message: dict, data_urls: dict[str, str]) -> dict:
+    if not any(url in data_urls for url in _image_urls(message)):
+        return message
+
+    content = []
+    for part in message["content"]:
+        if isinstance(part, dict) and part.get("type") == "image_url" and (data_url := data_urls.get(_part_url(part))):
+            image_url = dict(part["image_url"], url=data_url) if isinstance(part["image_url"], dict) else data_url
+            part = dict(part, image_url=image_url)
+        content.append(part)
+
+    return dict(message, content=content)
+
+
+# INIT
+
+pipeline = (
+    AttachmentPipeline(
+        config.attachment_max_bytes,
+        config.attachment_max_edge,
+        config.attachment_quality,
+        config.attachment_fetch_timeout,
+        config.attachment_max_connections,
+        config.attachment_cache_size,
+    )
+    if config.attachments_inline and Image is not None
+    else None
+)
+
+
+def setup(app: FastAPI):
+    if config.attachments_inline and Image is None:
+        logging.get_logger().warning("ATTACHMENTS_INLINE is set but pillow is not installed, attachments are passed on as urls")
+
+    if pipeline:
+        app.add_event_handler("shutdown", pipeline.close)
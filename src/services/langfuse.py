@@ -1,10 +1,14 @@
-from langfuse import Langfuse
-from langfuse.model import PromptClient
-
+from typing import TYPE_CHECKING
 from pydantic import BaseModel
 
-from fastapi.concurrency import run_in_threadpool
-import os
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI
+import asyncio, functools, importlib, threading, time, os
+
+if TYPE_CHECKING:  # langfuse is imported on first use as it is slow to import
+    from langfuse.model import PromptClient
+
+import config
 
 
 # DATA
@@ -26,23 +30,190 @@ class PromptConfig(BaseModel):
 
 
 class ClientManager:
+    """
+    Langfuse clients per project built from LANGFUSE_PUBLIC_KEY_<PROJECT> and LANGFUSE_SECRET_KEY_<PROJECT>
+    (and optionally LANGFUSE_HOST_<PROJECT>) without touching the process environment.
+
+    All clients are built together on first use or when warming up, so concurrent first requests
+    neither race nor pay the construction cost per project.
+    """
+
     clients = {}
+    settings = {}
+    _lock = threading.Lock()
+    _loaded = False
+
+    @staticmethod
+    def discover(environ=os.environ) -> dict[str, dict]:
+        "Client settings per upper case project name for each complete key pair."
+
+        prefix = "LANGFUSE_PUBLIC_KEY_"
+        projects = {}
+
+        for name, public_key in environ.items():
+            if not name.startswith(prefix) or not public_key:
+                continue
+
+            project = name.removeprefix(prefix)
+            if not (secret_key := environ.get(f"LANGFUSE_SECRET_KEY_{project}")):
+                continue
+
+            projects[project] = dict(public_key=public_key, secret_key=secret_key)
+            if host := environ.get(f"LANGFUSE_HOST_{project}", environ.get("LANGFUSE_HOST")):
+                projects[project]["host"] = host
+
+        return projects
 
     @classmethod
-    def _init_client(cls, project: str):
-        # set standardized keys as litellm creates client internally overriding params
-        os.environ["LANGFUSE_PUBLIC_KEY"] = os.getenv(f"LANGFUSE_PUBLIC_KEY_{project.upper()}")
-        os.environ["LANGFUSE_SECRET_KEY"] = os.getenv(f"LANGFUSE_SECRET_KEY_{project.upper()}")
-        cls.clients[project] = Langfuse()
+    def load(cls):
+        if cls._loaded:
+            return
+
+        with cls._lock:
+            if cls._loaded:
+                return
+
+            Langfuse = importlib.import_module("langfuse").Langfuse
+            cls.settings = cls.discover()
+            for project, project_settings in cls.settings.items():
+                cls.clients.setdefault(project, Langfuse(**project_settings))
+            cls._loaded = True
 
     @classmethod
     def get_client(cls, project: str):
-        if project not in cls.clients:
-            cls._init_client(project)
+        cls.load()
 
-        return cls.clients[project]
+        if (client := cls.clients.get(project.upper())) is None:
+            raise ValueError(f"No Langfuse keys set for project '{project}'")
+        return client
 
-
-async def fetch_prompt(prompt_config: PromptConfig) -> PromptClient:
+    @classmethod
+    def callback_params(cls, project: str) -> dict:
+        "Per request credentials so litellm's langfuse callback traces to the project without global env keys."
+
+        cls.load()
+
+        if not (settings := cls.settings.get(project.upper())):
+            return {}
+        return {f"langfuse_{key}": value for key, value in settings.items()}
+
+
+class PromptCache:
+    """
+    In-process prompt cache keyed by (project, name, label, version).
+
+    Fresh entries are served for `ttl` seconds, afterwards stale entries are served for up to
+    `max_stale` more seconds while a background refresh runs. Concurrent fetches for the same
+    key share a single upstream request.
+    """
+
+    def __init__(self, ttl: float, max_stale: float):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._entries = {}  # key -> (prompt, fetched_at)
+        self._inflight = {}  # key -> task
+        # ---
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.refresh_seconds = 0.0
+        self.last_refresh_seconds = 0.0
+
+    @staticmethod
+    def key(prompt_config: PromptConfig) -> tuple:
+        args = prompt_config.args
+        return (prompt_config.project, args.name, args.label, args.version)
+
+    def _on_done(self, key, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # mark as retrieved as background refreshes may have no awaiter
+
+    async def _refresh(self, key, fetch) -> "PromptClient":
+        start_time = time.perf_counter()
+        try:
+            prompt = await fetch()
+        except Exception:
+            self.refresh_errors += 1
+            raise
+
+        self.last_refresh_seconds = time.perf_counter() - start_time
+        self.refresh_seconds += self.last_refresh_seconds
+        self.refreshes += 1
+
+        self._entries[key] = (prompt, time.monotonic())
+        return prompt
+
+    def _fetch(self, key, fetch) -> asyncio.Task:
+        if task := self._inflight.get(key):
+            self.coalesced += 1
+            return task
+
+        task = asyncio.create_task(self._refresh(key, fetch))
+        task.add_done_callback(lambda t: self._on_done(key, t))
+        self._inflight[key] = task
+        return task
+
+    async def get(self, key, fetch) -> "PromptClient":
+        if self.ttl <= 0:
+            return await fetch()
+
+        if entry := self._entries.get(key):
+            prompt, fetched_at = entry
+            age = time.monotonic() - fetched_at
+
+            if age < self.ttl:
+                self.hits += 1
+                return prompt
+
+            if age < self.ttl + self.max_stale:
+                self.stale_hits += 1
+                self._fetch(key, fetch)
+                return prompt
+
+        self.misses += 1
+        # shield so a cancelled request does not cancel the fetch others may be waiting on
+        return await asyncio.shield(self._fetch(key, fetch))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return dict(
+            size=len(self._entries),
+            hits=self.hits,
+            stale_hits=self.stale_hits,
+            misses=self.misses,
+            coalesced=self.coalesced,
+            hit_ratio=round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            refreshes=self.refreshes,
+            refresh_errors=self.refresh_errors,
+            refresh_avg_ms=round(self.refresh_seconds / self.refreshes * 1000, 2) if self.refreshes else 0.0,
+            refresh_last_ms=round(self.last_refresh_seconds * 1000, 2),
+        )
+
+
+# INIT
+
+prompt_cache = PromptCache(config.prompt_cache_ttl, config.prompt_cache_max_stale)
+
+# blocking langfuse calls get their own bounded pool so slow fetches do not starve starlette's threadpool
+executor = ThreadPoolExecutor(max_workers=config.langfuse_max_workers, thread_name_prefix="langfuse")
+
+
+def setup(app: FastAPI):
+    app.add_event_handler("shutdown", lambda: executor.shutdown(wait=False, cancel_futures=True))
+
+
+# INTERFACE
+
+
+async def fetch_prompt(prompt_config: PromptConfig) -> "PromptClient":
     lf = ClientManager.get_client(prompt_config.project)
-    return await run_in_threadpool(lf.get_prompt, **prompt_config.args.model_dump())
+
+    async def fetch():
+        get_prompt = functools.partial(lf.get_prompt, **prompt_config.args.model_dump())
+        return await asyncio.get_running_loop().run_in_executor(executor, get_prompt)
+
+    return await prompt_cache.get(PromptCache.key(prompt_config), fetch)
@@ -1,8 +1,43 @@
-import litellm
+from functools import cache
+import importlib, json, os, threading
+
+from src.services import traces
+import config
 
 # native langfuse integration: https://docs.litellm.ai/docs/proxy/prompt_management
 # async version: https://docs.litellm.ai/docs/completion/stream
 
+# use the cost map bundled with the installed litellm instead of fetching it over the network at import
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+_litellm = None
+_lock = threading.Lock()
+
+
+def provider():
+    "Import and configure litellm on first use as importing it takes seconds."
+
+    global _litellm
+
+    if _litellm is None:
+        with _lock:
+            if _litellm is None:
+                module = importlib.import_module("litellm")
+                if config.trace_export == "batched":
+                    module.callbacks = [traces.callback()]
+                elif config.trace_export == "litellm":
+                    module.success_callback = ["langfuse"]
+                    module.failure_callback = ["langfuse"]
+                # module._turn_on_debug()
+
+                if config.model_cost_map_path:
+                    with open(config.model_cost_map_path) as file:
+                        module.register_model(json.load(file))
+
+                _litellm = module
+
+    return _litellm
+
 
 def grab_content(response):
     _response_message = response.choices[0].message
@@ -11,15 +46,94 @@ def grab_content(response):
     return reply, tool_calls, _response_message
 
 
+def total_tokens(response) -> int:
+    usage = getattr(response, "usage", None)
+    return usage.total_tokens if usage else 0
+
+
 async def async_call(**params):
     "providers: https://docs.litellm.ai/docs/providers"
 
-    response = await litellm.acompletion(**params)
-    return grab_content(response)
+    response = await provider().acompletion(**params)
+    return *grab_content(response), total_tokens(response)
 
 
 def call(**params):
     "providers: https://docs.litellm.ai/docs/providers"
 
-    response = litellm.completion(**params)
-    return grab_content(response)
+    response = provider().completion(**params)
+    return *grab_content(response), total_tokens(response)
+
+
+class StreamCollector:
+    """Assembles streamed deltas into the same reply, tool calls and message a regular call returns."""
+
+    def __init__(self):
+        self._content = []
+        self._tool_calls = {}
+        self.tokens = 0
+
+    def _add_tool_call(self, position, tool_call_delta) -> dict:
+        index = tool_call_delta.index if tool_call_delta.index is not None else position
+        tool_call = self._tool_calls.setdefault(index, dict(id=None, type="function", function=dict(name="", arguments="")))
+
+        if tool_call_delta.id:
+            tool_call["id"] = tool_call_delta.id
+
+        function = tool_call_delta.function
+        name = (function.name or "") if function else ""
+        arguments = (function.arguments or "") if function else ""
+        tool_call["function"]["name"] += name
+        tool_call["function"]["arguments"] += arguments
+
+        return dict(index=index, id=tool_call_delta.id, name=name or None, arguments=arguments or None)
+
+    def add(self, chunk) -> dict | None:
+        "Collect a chunk and return its client facing event data if it carries anything."
+
+        self.tokens = total_tokens(chunk) or self.tokens
+        if not chunk.choices:
+            return None
+
+        delta = chunk.choices[0].delta
+        event_data = {}
+
+        if delta.content:
+            self._content.append(delta.content)
+            event_data["content"] = delta.content
+
+        if delta.tool_calls:
+            event_data["tool_calls"] = [self._add_tool_call(position, tc) for position, tc in enumerate(delta.tool_calls)]
+
+        return event_data or None
+
+    def result(self):
+        reply = "".join(self._content) or None
+        tool_calls = [self._tool_calls[index] for index in sorted(self._tool_calls)] or None
+
+        response_message = dict(role="assistant", content=reply)
+        if tool_calls:
+            response_message["tool_calls"] = tool_calls
+
+        return reply, tool_calls, response_message
+
+
+@cache
+def _reports_stream_usage(model: str) -> bool:
+    try:
+        litellm = provider()
+        _, llm_provider, _, _ = litellm.get_llm_provider(model)
+        return "stream_options" in (litellm.get_supported_openai_params(model=model, custom_llm_provider=llm_provider) or [])
+    except Exception:
+        return False
+
+
+async def async_stream(**params):
+    "yields chunks: https://docs.litellm.ai/docs/completion/stream"
+
+    if _reports_stream_usage(params.get("model", "")):
+        params.setdefault("stream_options", dict(include_usage=True))
+
+    response = await provider().acompletion(**params, stream=True)
+    async for chunk in response:
+        yield chunk
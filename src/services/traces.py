@@ -0,0 +1,312 @@
+from collections import deque
+from datetime import datetime, timezone
+from fastapi import FastAPI
+import asyncio, httpx, importlib, json, os, threading, time, uuid
+
+from src.core import codec, logging, metrics
+import config
+
+
+# HELPER
+
+EXPORTS = ("batched", "litellm", "off")
+DROP_POLICIES = ("oldest", "newest")
+INGESTION_PATH = "/api/public/ingestion"
+DEFAULT_HOST = "https://cloud.langfuse.com"
+TRACE_KEYS = ("session_id", "trace_id", "trace_name", "trace_user_id", "generation_name", "tags", "prompt")  # metadata read like litellm's langfuse callback
+
+
+def _timestamp(seconds: float | None = None) -> str:
+    return datetime.fromtimestamp(seconds if seconds is not None else time.time(), timezone.utc).isoformat()
+
+
+def _event(kind: str, body: dict) -> dict:
+    return dict(id=str(uuid.uuid4()), timestamp=_timestamp(), type=kind, body=body)
+
+
+def _credentials(dynamic_params: dict) -> tuple[str, str, str] | None:
+    "Langfuse keys and host passed with the completion (see ClientManager.callback_params) or set globally."
+
+    public_key = dynamic_params.get("langfuse_public_key") or os.getenv("LANGFUSE_PUBLIC_KEY")
+    secret_key = dynamic_params.get("langfuse_secret_key") or dynamic_params.get("langfuse_secret") or os.getenv("LANGFUSE_SECRET_KEY")
+    host = dynamic_params.get("langfuse_host") or os.getenv("LANGFUSE_HOST") or DEFAULT_HOST
+
+    if not (public_key and secret_key):
+        return None
+    return public_key, secret_key, host.rstrip("/")
+
+
+def build_events(kwargs: dict) -> tuple[tuple[str, str, str] | None, list[dict]]:
+    "Langfuse ingestion events (a trace and its generation) for one litellm call from its logging kwargs."
+
+    payload = kwargs.get("standard_logging_object")
+    if not payload:
+        return None, []
+
+    metadata = {k: v for k, v in ((kwargs.get("litellm_params") or {}).get("metadata") or {}).items() if k != "hidden_params"}
+    call_id = kwargs.get("litellm_call_id") or payload.get("id") or str(uuid.uuid4())
+    trace_id = metadata.get("trace_id") or call_id
+    failed = payload.get("status") == "failure"
+
+    response = payload.get("response") or {}
+    choices = response.get("choices") if isinstance(response, dict) else None
+    output = choices[0].get("message") if choices else response or None
+
+    prompt = metadata.get("prompt")  # langfuse prompt linked to the generation
+    custom_metadata = {k: v for k, v in metadata.items() if k not in TRACE_KEYS}
+    trace = dict(
+        id=trace_id,
+        timestamp=_timestamp(payload.get("startTime")),
+        name=metadata.get("trace_name") or f"litellm-{payload.get('call_type')}",
+        userId=metadata.get("trace_user_id"),
+        sessionId=metadata.get("session_id"),
+        tags=metadata.get("tags"),
+        input=payload.get("messages"),
+        output=output,
+        metadata=custom_metadata,
+    )
+    generation = dict(
+        id=payload.get("id") or call_id,
+        traceId=trace_id,
+        name=metadata.get("generation_name") or f"litellm-{payload.get('call_type')}",
+        startTime=_timestamp(payload.get("startTime")),
+        endTime=_timestamp(payload.get("endTime")),
+        completionStartTime=_timestamp(payload["completionStartTime"]) if payload.get("completionStartTime") else None,
+        model=payload.get("model"),
+        modelParameters={k: v for k, v in (payload.get("model_parameters") or {}).items() if isinstance(v, (str, int, float, bool))},
+        input=payload.get("messages"),
+        output=output,
+        usage=dict(
+            input=payload.get("prompt_tokens") or 0,
+            output=payload.get("completion_tokens") or 0,
+            total=payload.get("total_tokens") or 0,
+            unit="TOKENS",
+        ),
+        costDetails=dict(total=payload["response_cost"]) if payload.get("response_cost") else None,
+        promptName=getattr(prompt, "name", None),
+        promptVersion=getattr(prompt, "version", None),
+        level="ERROR" if failed else "DEFAULT",
+        statusMessage=payload.get("error_str") if failed else None,
+        metadata=custom_metadata,
+    )
+
+    credentials = _credentials(kwargs.get("standard_callback_dynamic_params") or {})
+    return credentials, [_event("trace-create", trace), _event("generation-create", generation)]
+
+
+class TraceExporter:
+    """
+    Queues Langfuse ingestion events in memory and sends them in batches from a background task.
+
+    Events are queued with plain deque operations under a lock, so recording from litellm's
+    callbacks (on the event loop or in its logging threads) never waits on Langfuse. The flusher
+    sends a batch once `batch_size` events are queued or `flush_interval` seconds passed, one
+    request per Langfuse project. When the queue is full the "oldest" queued or the "newest"
+    incoming event is dropped. Failed batches are counted and not retried, so an unavailable
+    Langfuse costs neither memory nor latency. Remaining events are sent on shutdown.
+    """
+
+    def __init__(self, max_queue: int, batch_size: int, flush_interval: float, drop_policy: str, timeout: float, shutdown_timeout: float):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown trace drop policy '{drop_policy}', expected one of: {', '.join(DROP_POLICIES)}")
+
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self.timeout = timeout
+        self.shutdown_timeout = shutdown_timeout
+        # ---
+        self._queue = deque()  # (credentials, event)
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wake = None
+        self._task = None
+        self._stopping = False
+        self._client = None
+
+    def _notify(self):
+        if self._loop is None or self._loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is self._loop:
+            self._wake.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def enqueue(self, credentials: tuple[str, str, str], events: list[dict]):
+        dropped = 0
+        with self._lock:
+            for event in events:
+                if len(self._queue) >= self.max_queue:
+                    dropped += 1
+                    if self.drop_policy == "newest":
+                        continue
+                    self._queue.popleft()
+                self._queue.append((credentials, event))
+            depth = len(self._queue)
+
+        metrics.trace_queue_depth.set(depth)
+        if dropped:
+            metrics.trace_events.inc("dropped", amount=dropped)
+        if depth >= self.batch_size:
+            self._notify()
+
+    def record(self, kwargs: dict):
+        "Queue the trace of one litellm call, skipping calls without langfuse keys."
+
+        try:
+            credentials, events = build_events(kwargs)
+        except Exception as e:
+            metrics.trace_events.inc("failed")
+            logging.get_logger().warning(f"Trace not recorded: {type(e).__name__}: {e}")
+            return
+
+        if not events:
+            return
+        if credentials is None:
+            metrics.trace_events.inc("skipped", amount=len(events))
+            return
+        self.enqueue(credentials, events)
+
+    def _take_batch(self) -> list[tuple[tuple[str, str, str], dict]]:
+        with self._lock:
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            depth = len(self._queue)
+        metrics.trace_queue_depth.set(depth)
+        return batch
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout))
+        return self._client
+
+    async def _send(self, credentials: tuple[str, str, str], events: list[dict]):
+        public_key, secret_key, host = credentials
+        body = dict(batch=events, metadata=dict(batch_size=len(events), sdk_name="overlord"))
+        try:
+            content = codec.dumps_bytes(body)
+        except TypeError:  # message content litellm did not convert to plain json
+            content = json.dumps(body, default=str).encode()
+
+        start_time = time.perf_counter()
+        try:
+            response = await self._get_client().post(
+                f"{host}{INGESTION_PATH}",
+                content=content,
+                headers={"content-type": "application/json"},
+                auth=(public_key, secret_key),
+            )
+            response.raise_for_status()
+            errors = len(response.json().get("errors") or []) if response.status_code == 207 else 0
+
+        except Exception as e:
+            metrics.trace_flushes.inc("error")
+            metrics.trace_events.inc("failed", amount=len(events))
+            logging.get_logger().warning(f"Trace export of {len(events)} events failed: {type(e).__name__}: {e}")
+            return
+
+        finally:
+            metrics.trace_export_seconds.observe(time.perf_counter() - start_time)
+
+        metrics.trace_flushes.inc("ok")
+        metrics.trace_events.inc("exported", amount=len(events) - errors)
+        if errors:
+            metrics.trace_events.inc("failed", amount=errors)
+            logging.get_logger().warning(f"Langfuse rejected {errors} of {len(events)} trace events")
+
+    async def flush(self):
+        "Send everything queued in batches."
+
+        while batch := self._take_batch():
+            projects = {}
+            for credentials, event in batch:
+                projects.setdefault(credentials, []).append(event)
+            await asyncio.gather(*(self._send(credentials, events) for credentials, events in projects.items()))
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+            if self._stopping:
+                break
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        "Stop the flusher after sending the queued events, dropping what is left after the shutdown timeout."
+
+        if self._task is not None:
+            self._stopping = True
+            self._wake.set()
+            try:
+                await asyncio.wait_for(self._task, self.shutdown_timeout)
+            except asyncio.TimeoutError:
+                logging.get_logger().warning("Trace export did not finish before the shutdown timeout")
+            self._task = None
+
+        with self._lock:
+            dropped = len(self._queue)
+            self._queue.clear()
+        if dropped:
+            metrics.trace_events.inc("dropped", amount=dropped)
+        metrics.trace_queue_depth.set(0)
+
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def callback():
+    "litellm callback handing every completion to the exporter, created on first use as it subclasses litellm's logger."
+
+    CustomLogger = importlib.import_module("litellm.integrations.custom_logger").CustomLogger
+
+    class TraceLogger(CustomLogger):
+        def log_success_event(self, kwargs, response_obj, start_time, end_time):
+            exporter.record(kwargs)
+
+        def log_failure_event(self, kwargs, response_obj, start_time, end_time):
+            exporter.record(kwargs)
+
+        async def async_log_success_event(self, kwargs, response_obj, start_time, end_time):
+            exporter.record(kwargs)
+
+        async def async_log_failure_event(self, kwargs, response_obj, start_time, end_time):
+            exporter.record(kwargs)
+
+    return TraceLogger()
+
+
+# INIT
+
+if config.trace_export not in EXPORTS:
+    raise ValueError(f"Unknown trace export '{config.trace_export}', expected one of: {', '.join(EXPORTS)}")
+
+exporter = TraceExporter(
+    config.trace_queue_size,
+    config.trace_batch_size,
+    config.trace_flush_interval,
+    config.trace_drop_policy,
+    config.trace_export_timeout,
+    config.trace_shutdown_timeout,
+)
+
+
+def setup(app: FastAPI):
+    if config.trace_export == "batched":
+        app.add_event_handler("startup", exporter.start)
+        app.add_event_handler("shutdown", exporter.stop)
@@ -0,0 +1,73 @@
+import asyncio, json, os
+
+os.environ.setdefault("ACCESS_KEYS", '["test-key"]')
+os.environ.setdefault("RATE_LIMITS_DEFAULT", '["1000/second"]')
+
+import websockets
+
+import client
+
+
+async def _slow_echo(websocket):
+    "Answers every turn after a delay with its prompt, like a chat session that is still running when given up."
+
+    async for message in websocket:
+        frame = json.loads(message)
+        await asyncio.sleep(frame.get("delay", 0))
+        await websocket.send(json.dumps(dict(event="delta", data=dict(content=frame["prompt"]))))
+        await websocket.send(json.dumps(dict(event="success", data=dict(reply=frame["prompt"], fresh=frame["fresh"]))))
+
+
+async def _reply(connection: client._Connection, prompt: str, delay: float = 0) -> dict:
+    async for event_type, event_data in connection.events(lambda fresh: dict(prompt=prompt, delay=delay, fresh=fresh)):
+        if event_type == "success":
+            return event_data
+
+
+def _run(test):
+    async def run():
+        async with websockets.serve(_slow_echo, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            api = client._Client(f"http://127.0.0.1:{port}", "test-key", "default")
+            return await test(client._Connection(api, "ai/ws"))
+
+    return asyncio.run(run())
+
+
+def test_turn_after_a_timed_out_turn_gets_its_own_reply():
+    async def test(connection):
+        try:
+            await asyncio.wait_for(_reply(connection, "topic 1", delay=0.2), 0.05)
+        except asyncio.TimeoutError:
+            pass
+        reply = await _reply(connection, "topic 2")
+        await asyncio.sleep(0.3)  # turn 1 would have been answered by now on a kept connection
+        return reply, await _reply(connection, "topic 3")
+
+    second, third = _run(test)
+
+    assert second == dict(reply="topic 2", fresh=True)
+    assert third == dict(reply="topic 3", fresh=False)
+
+
+def test_turn_after_breaking_out_of_a_stream_gets_its_own_reply():
+    async def test(connection):
+        async for event_type, _ in connection.events(lambda fresh: dict(prompt="topic 1", delay=0, fresh=fresh)):
+            assert event_type == "delta"
+            break
+        return await _reply(connection, "topic 2")
+
+    assert _run(test) == dict(reply="topic 2", fresh=True)
+
+
+def test_finished_turns_keep_the_connection():
+    async def test(connection):
+        await _reply(connection, "topic 1")
+        websocket = connection._websocket
+        reply = await _reply(connection, "topic 2")
+        return reply, connection._websocket is websocket
+
+    reply, kept = _run(test)
+
+    assert reply == dict(reply="topic 2", fresh=False)
+    assert kept
@@ -0,0 +1,161 @@
+import asyncio, os, time
+
+os.environ.setdefault("ACCESS_KEYS", '["test-key"]')
+os.environ.setdefault("RATE_LIMITS_DEFAULT", '["1000/second"]')
+
+from fastapi import FastAPI
+import pytest
+
+from src.core import logging
+from src.security import limits
+from src.security.limit_backends import RedisCounterBackend
+
+logging.setup(FastAPI(), "test")
+
+
+class RespStandIn:
+    """
+    Local stand-in for a Redis server answering the commands the counter backend sends.
+
+    `fail` maps a command to an error reply and `hang` accepts connections without ever replying.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.ttls = {}
+        self.commands = []
+        self.fail = {}
+        self.hang = False
+        self.connections = 0
+        self._server = None
+
+    async def _read_command(self, reader: asyncio.StreamReader) -> list[str]:
+        count = int((await reader.readline())[1:])
+        args = []
+        for _ in range(count):
+            length = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(length + 2))[:-2].decode())
+        return args
+
+    def _reply(self, command: str, args: list[str]) -> bytes:
+        if command in self.fail:
+            return f"-{self.fail[command]}\r\n".encode()
+        if command in ("AUTH", "SELECT"):
+            return b"+OK\r\n"
+        if command == "INCRBY":
+            self.values[args[0]] = self.values.get(args[0], 0) + int(args[1])
+            return b":%d\r\n" % self.values[args[0]]
+        if command == "EXPIRE":
+            self.ttls[args[0]] = int(args[1])
+            return b":1\r\n"
+        if command == "MGET":
+            values = [str(self.values[key]).encode() if key in self.values else None for key in args]
+            return b"*%d\r\n" % len(values) + b"".join(b"$-1\r\n" if v is None else b"$%d\r\n%s\r\n" % (len(v), v) for v in values)
+        return f"-ERR unknown command '{command}'\r\n".encode()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                command, *args = await self._read_command(reader)
+                self.commands.append((command, *args))
+                if not self.hang:
+                    writer.write(self._reply(command, args))
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ValueError, ConnectionError):
+            writer.close()
+
+    async def __aenter__(self) -> str:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return f"redis://:secret@127.0.0.1:{self._server.sockets[0].getsockname()[1]}/2"
+
+    async def __aexit__(self, *_):
+        self._server.close()
+
+
+def test_redis_backend_round_trips_counters():
+    async def test():
+        stand_in = RespStandIn()
+        async with stand_in as url:
+            backend = RedisCounterBackend(url, timeout=1)
+            first = await backend.sync({"a": (2, 60)}, ["a", "b"])
+            second = await backend.sync({"a": (1, 60), "b": (5, 30)}, ["a", "b"])
+        return stand_in, first, second
+
+    stand_in, first, second = asyncio.run(test())
+
+    assert first == dict(a=2)
+    assert second == dict(a=3, b=5)
+    assert stand_in.ttls == dict(a=60, b=30)
+    assert stand_in.commands[:2] == [("AUTH", "secret"), ("SELECT", "2")]
+    assert stand_in.connections == 1  # pipelined over one persistent connection
+
+
+def test_redis_backend_reconnects_after_an_error_reply_mid_pipeline():
+    async def test():
+        stand_in = RespStandIn()
+        async with stand_in as url:
+            backend = RedisCounterBackend(url, timeout=1)
+            stand_in.fail["EXPIRE"] = "ERR no expiry today"
+            with pytest.raises(RuntimeError, match="no expiry today"):
+                await backend.sync({"a": (1, 60)}, ["a"])
+            dropped = backend._writer is None
+
+            del stand_in.fail["EXPIRE"]
+            # replies left over from the failed pipeline must not be read as this sync's
+            totals = await backend.sync({"a": (1, 60)}, ["a"])
+        return stand_in, dropped, totals
+
+    stand_in, dropped, totals = asyncio.run(test())
+
+    assert dropped
+    assert totals == dict(a=2)
+    assert stand_in.connections == 2
+
+
+def test_redis_backend_times_out_on_a_hung_server():
+    async def test():
+        stand_in = RespStandIn()
+        stand_in.hang = True
+        async with stand_in as url:
+            backend = RedisCounterBackend(url, timeout=0.1)
+            start_time = time.perf_counter()
+            with pytest.raises(asyncio.TimeoutError):
+                await backend.sync({"a": (1, 60)}, ["a"])
+            return time.perf_counter() - start_time, backend._writer is None
+
+    seconds, dropped = asyncio.run(test())
+
+    assert seconds < 1
+    assert dropped
+
+
+def test_shared_limiter_counts_per_worker_while_the_backend_is_unavailable():
+    async def check(limiter: limits.SharedRateLimiter) -> bool:
+        status = await limiter.check("client", "default")
+        await asyncio.sleep(0.05)  # let the background sync run
+        return bool(status.exceeded)
+
+    async def test():
+        stand_in = RespStandIn()
+        stand_in.hang = True
+        async with stand_in as url:
+            limiter = limits.setup(dict(default=["3/minute"]), "redis", url, sync_interval=0, backend_timeout=0.02)
+
+            start_time = time.perf_counter()
+            exceeded = [await check(limiter) for _ in range(4)]
+            seconds = time.perf_counter() - start_time
+            unavailable = not limiter.available
+
+            stand_in.hang = False
+            await check(limiter)  # flushes the counts kept meanwhile
+            await asyncio.sleep(0.05)
+        return exceeded, seconds, unavailable, limiter, stand_in
+
+    exceeded, seconds, unavailable, limiter, stand_in = asyncio.run(test())
+
+    assert exceeded == [False, False, False, True]
+    assert seconds < 1  # checks never waited on the hung server
+    assert unavailable and limiter.sync_errors > 0
+    assert limiter.available
+    assert sum(stand_in.values.values()) == 3
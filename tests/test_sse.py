@@ -0,0 +1,93 @@
+import asyncio, os
+
+os.environ.setdefault("ACCESS_KEYS", '["test-key"]')
+os.environ.setdefault("RATE_LIMITS_DEFAULT", '["1000/second"]')
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+from fastapi import FastAPI
+from sse_starlette.sse import AppStatus
+import httpx, litellm, pytest
+
+from src.core import sse
+from src.core.admission import ServiceOverloaded
+import client
+
+
+@pytest.fixture(autouse=True)
+def _reset_sse_exit_event():
+    # sse_starlette binds its shutdown event to the first loop, every test runs its own
+    AppStatus.should_exit_event = None
+
+
+class FlakyProvider:
+    "Raises the given errors in order and answers once they are used up."
+
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return dict(content="hello")
+
+
+def _app(provider: FlakyProvider) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/chat")
+    @sse.endpoint
+    async def chat():
+        return await provider()
+
+    return app
+
+
+def _client(app: FastAPI, retries: int = 0) -> client._Client:
+    api = client._Client("http://test", "test-key", "default", retry_policy=client.RetryPolicy(retries=retries, backoff=0))
+    api._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), headers=api._client.headers)
+    return api
+
+
+def _post(app: FastAPI) -> httpx.Response:
+    async def post():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            return await http.post("/chat")
+
+    return asyncio.run(post())
+
+
+def test_provider_error_is_an_error_event_with_status_200():
+    response = _post(_app(FlakyProvider(litellm.Timeout("took too long", model="gpt-4o", llm_provider="openai"))))
+
+    assert response.status_code == 200
+    assert "event: error" in response.text
+    assert '"type":"Timeout"' in response.text.replace(" ", "")
+
+
+def test_shed_request_is_503_with_retry_after():
+    response = _post(_app(FlakyProvider(ServiceOverloaded("Too many requests waiting for the model"))))
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(ServiceOverloaded.retry_after)
+    assert "event: error" in response.text
+
+
+def test_client_raises_and_retries_provider_errors_by_name():
+    async def requests() -> tuple[Exception, dict, int]:
+        provider = FlakyProvider(litellm.Timeout("took too long", model="gpt-4o", llm_provider="openai"))
+        try:
+            await anext(_client(_app(provider)).request("chat", "POST", data={}))
+        except Exception as e:
+            error = e
+
+        provider = FlakyProvider(litellm.Timeout("took too long", model="gpt-4o", llm_provider="openai"))
+        result = await anext(_client(_app(provider), retries=1).request("chat", "POST", data={}))
+        return error, result, provider.calls
+
+    error, result, calls = asyncio.run(requests())
+
+    assert type(error).__name__ == "Timeout"
+    assert result == dict(content="hello")
+    assert calls == 2